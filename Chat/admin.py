@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Room, Message, UserRoomStatus
+from .models import Room, Message, MessageReaction, UserRoomStatus
 
 # Inline for displaying messages in the Room admin
 class MessageInline(admin.TabularInline):
@@ -57,3 +57,4 @@ class MessageAdmin(admin.ModelAdmin):
     mentions_list.short_description = 'Mentions'
 
 admin.site.register(UserRoomStatus)
+admin.site.register(MessageReaction)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Chat'
+
+    def ready(self):
+        import Chat.signals
+        from Chat.partitions import ensure_partitions_after_migrate
+        post_migrate.connect(ensure_partitions_after_migrate, sender=self)
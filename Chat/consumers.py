@@ -1,44 +1,171 @@
+import asyncio
 import json
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
 from asgiref.sync import sync_to_async
-from django.core.cache import cache
-
-
-
-ONLINE_USERS_KEY = "online_users"
+from functools import partial
+from django.conf import settings
+from core.websocket import JSON, InflateError, WireProtocolMixin, pack_frame
+from . import events, presence, read_receipts
+from .flow_control import ActionLimiter, OutboundQueue, CLOSE_CODE_TOO_SLOW
+from .typing_indicators import coalescer as typing_coalescer
+
+logger = logging.getLogger(__name__)
+
+# Strong references to in-flight background deliveries; the event loop only keeps
+# weak references to tasks, so without this they could be collected mid-flight.
+_background_tasks = set()
+
+def run_in_background(coro):
+    """
+    Schedule a coroutine on the running event loop without awaiting it, so slow
+    side effects (FCM, e-mail, ...) never delay the socket handler.
+    """
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def message_fields_error(message, message_type, attachment, mentions, parent_message_id):
+    """
+    Return why the fields of a send_message action cannot be stored, or None if they can.
+    Checked before the message is broadcast, since the write-behind flusher can no
+    longer reject it.
+    """
+    from .models import Message
+    if message is not None and not isinstance(message, str):
+        return "'message' must be a string."
+    if not isinstance(message_type, str) or message_type not in dict(Message.MESSAGE_TYPE_CHOICES):
+        return "Invalid 'message_type'."
+    if attachment is not None and (
+        not isinstance(attachment, str)
+        or len(attachment) > Message._meta.get_field("attachment").max_length
+    ):
+        return "Invalid 'attachment'."
+    if mentions is not None and (
+        not isinstance(mentions, list)
+        or not all(isinstance(user_id, int) and not isinstance(user_id, bool) for user_id in mentions)
+    ):
+        return "'mentions' must be a list of user ids."
+    if parent_message_id is not None and (
+        not isinstance(parent_message_id, int) or isinstance(parent_message_id, bool)
+    ):
+        return "'parent_message_id' must be a message id."
+    return None
+
+def get_recipient_ids(room_id, sender_id):
+    """
+    Return the IDs of the room members, excluding the sender.
+    """
+    from .models import Room
+    return list(
+        Room.members.through.objects.filter(
+            room_id=room_id
+        ).exclude(user_id=sender_id).values_list("user_id", flat=True)
+    )
+
+async def deliver_push_notifications(room_id, room_name, sender_id, message):
+    """
+    Background delivery stage for chat push notifications.
+
+    Resolves the offline recipients and their device tokens in bulk and hands them to FCM
+    as multicast batches. Runs outside the socket handler, so message latency does not
+    grow with the size of the room.
+    """
+    from Notification.utils import send_push_notification_multicast
+
+    try:
+        recipient_ids = await database_sync_to_async(get_recipient_ids)(room_id, sender_id)
+        online_ids = await presence.online_user_ids(recipient_ids)
+        recipient_ids = [user_id for user_id in recipient_ids if user_id not in online_ids]
+        if not recipient_ids:
+            return
 
-def should_send_push_notification(user_id):
-    online_users = cache.get(ONLINE_USERS_KEY, set())
-    return user_id not in online_users
+        # FCM calls are network bound, keep them off the shared thread used for ORM calls.
+        responses = await database_sync_to_async(send_push_notification_multicast, thread_sensitive=False)(
+            recipient_ids,
+            title=f"New message in {room_name}",
+            body=message if len(message) < 50 else message[:50] + "...",
+            click_action=f"OPEN_CHAT?room_id={room_id}",
+        )
+        for response in responses:
+            logger.info(
+                "Push fan-out for room %s: %s sent, %s failed",
+                room_id, response.success_count, response.failure_count,
+            )
+    except Exception:
+        logger.exception("Error sending push notifications for room %s", room_id)
+
+async def deliver_mention_notifications(channel_layer, notifications):
+    """
+    Send mention notifications to every mentioned user's notifications group concurrently.
+    """
+    await asyncio.gather(*[
+        channel_layer.group_send(
+            f"notifications_{notification.user_id}",
+            {
+                "type": "send_notification",
+                "notification": {
+                    "id": notification.id,
+                    "event_type": notification.event_type,
+                    "message": notification.message,
+                    "url": notification.url,
+                    "created_at": notification.created_at.isoformat(),
+                },
+            },
+        )
+        for notification in notifications
+    ])
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(WireProtocolMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
         self.room_group_name = f"chat_{self.room_id}"
         user = self.scope["user"]
+        self.user_id = user.id if user.is_authenticated else None
+        self.heartbeat_task = None
+        self.sender_details = None
+        self.connected = False
+        self.read_receipts = read_receipts.ReadReceiptThrottle(partial(self.publish_read_receipt, self.room_id))
+
+        # Room metadata and membership are checked once here and kept up to date by
+        # chat_room_updated events, so the send path never looks them up again.
+        self.room = await self.load_room(user, self.room_id) if user.is_authenticated else None
+        if self.room is None:
+            await self.close(code=4403)
+            return
 
-        if user.is_authenticated:
-            online_users = cache.get(ONLINE_USERS_KEY, set())
-            online_users.add(user.id)
-            cache.set(ONLINE_USERS_KEY, online_users)
+        # Identity sent with every message/typing event; built once per connection
+        self.sender_details = await sync_to_async(self.get_sender_details)(user)
+        self.start_flow_control(user.id)
+        await presence.connect(user.id, self.channel_name)
+        self.heartbeat_task = run_in_background(self.presence_heartbeat(user.id))
 
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name,
         )
+        # self.room goes back to None when the user is removed, so cleanup keys on this
+        self.connected = True
 
-        await self.accept()
+        await self.accept_wire()
 
     async def disconnect(self, close_code):
-        user = self.scope["user"]
-
-        if user.is_authenticated:
-            online_users = cache.get(ONLINE_USERS_KEY, set())
-            if user.id in online_users:
-                online_users.remove(user.id)
-                cache.set(ONLINE_USERS_KEY, online_users)
-
+        if not getattr(self, "connected", False):
+            return
+        self.connected = False
+
+        self.heartbeat_task.cancel()
+        self.writer_task.cancel()
+        typing_coalescer.forget(self.room_group_name, self.user_id)
+        if self.room is None:
+            # Removed from the room: its read position is no longer this socket's to move
+            self.read_receipts.discard()
+        else:
+            await self.read_receipts.close()
+        await presence.disconnect(self.user_id, self.channel_name)
 
         # Leave room group
         await self.channel_layer.group_discard(
@@ -46,19 +173,88 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name,
         )
 
+    def start_flow_control(self, user_id):
+        self.limiter = ActionLimiter(user_id)
+        self.outbound = OutboundQueue(self.send_frame, self.close_too_slow)
+        self.writer_task = run_in_background(self.outbound.run())
+
+    async def close_too_slow(self):
+        logger.warning(
+            "Closing chat socket of user %s: %s frames behind", self.user_id, len(self.outbound.frames)
+        )
+        await self.close(code=CLOSE_CODE_TOO_SLOW)
+
+    async def allow_action(self, action):
+        """
+        Take a token for `action`, telling the client when it is over its budget.
+        """
+        retry_after = await self.limiter.check(action)
+        if not retry_after:
+            return True
+        if not self.limiter.is_silent(action):
+            await self.send_payload({
+                "error": "Rate limit exceeded.",
+                "action": action,
+                "retry_after": round(retry_after, 2),
+            })
+        return False
+
+    @database_sync_to_async
+    def load_room(self, user, room_id):
+        """
+        Return the room if it is active and `user` is a member of it, otherwise None.
+        """
+        from .models import Room
+        return Room.objects.filter(
+            id=room_id, is_active=True, members=user
+        ).only("id", "name", "is_active", "message_seq").first()
+
+    async def presence_heartbeat(self, user_id):
+        """
+        Keep this connection's presence entry alive for as long as the socket is open.
+        """
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                await presence.heartbeat(user_id, self.channel_name)
+            except Exception:
+                logger.exception("Presence heartbeat failed for user %s", user_id)
+
     # Receive message from WebSocket
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({"error": "Invalid JSON format"}))
+            text_data_json = self.decode_payload(text_data, bytes_data)
+        except InflateError as e:
+            logger.warning("Closing chat socket of user %s: %s", self.user_id, e)
+            await self.close(code=e.close_code)
+            return
+        except ValueError:
+            await self.send_payload({"error": "Invalid JSON format"})
             return
+        await self.handle_action(text_data_json)
 
+    async def send_payload(self, payload):
+        """
+        Queue a reply for this socket. Replies share the outbound queue with broadcast
+        frames, so everything reaches the socket in the order it went through the
+        connection's deflater.
+        """
+        if self.wire == JSON:
+            self.outbound.put(json.dumps(payload), None)
+        else:
+            self.outbound.put(None, pack_frame(payload))
+
+    async def handle_action(self, text_data_json):
+        """
+        Run a client action against the current room (self.room).
+        """
         action = text_data_json.get("action", "send_message")
+        if not await self.allow_action(action):
+            return
 
         if action == "send_message":
             if "message" not in text_data_json:
-                await self.send(text_data=json.dumps({"error": "Missing 'message' field for send_message action."}))
+                await self.send_payload({"error": "Missing 'message' field for send_message action."})
                 return
 
             # Existing code for sending a new message
@@ -69,102 +265,66 @@ class ChatConsumer(AsyncWebsocketConsumer):
             mentions = text_data_json.get("mentions", None)
             parent_message_id = text_data_json.get("parent_message_id", None)
 
+            error = message_fields_error(message, message_type, attachment, mentions, parent_message_id)
+            if error:
+                await self.send_payload({"error": error})
+                return
+
             if sender.is_authenticated:
-                from .models import Room
-                room_obj = await sync_to_async(Room.objects.get)(id=self.room_id)
-                room_name = room_obj.name
-
-                # Exclude the sender from the recipients
-                recipients = await sync_to_async(list)(room_obj.members.exclude(id=sender.id))
-                
-                for recipient in recipients:
-                    # Check if recipient is offline
-                    if await sync_to_async(should_send_push_notification)(recipient.id):
-                        push_title = f"New message in {room_name}"
-                        push_body = message if len(message) < 50 else message[:50] + "..."
-                        push_click_action = f"OPEN_CHAT?room_id={self.room_id}"
-
-                        # Send push notification using your existing synchronous utility, wrapped in sync_to_async
-                        from Notification.utils import send_push_notification_individual
-                        
-                        try:
-                            # Send push notification using your synchronous utility, wrapped in sync_to_async
-                            response = await sync_to_async(send_push_notification_individual)(
-                                user=recipient,
-                                title=push_title,
-                                body=push_body,
-                                click_action=push_click_action
-                            )
-                            print(f"Push notification sent to recipient {recipient.id}: {response}")
-                        except Exception as e:
-                            print(f"Error sending push notification to recipient {recipient.id}: {e}")
-
-                sender_details = await sync_to_async(self.get_sender_details)(sender)
+                room_name = self.room.name
+                sender_details = self.sender_details
                 parent_message = None
 
                 if parent_message_id:
                     from .models import Message
                     try:
-                        parent_message = await sync_to_async(Message.objects.get)(id=parent_message_id)
+                        parent_message = await sync_to_async(
+                            Message.objects.select_related("sender").get
+                        )(id=parent_message_id, room_id=self.room_id)
                     except Message.DoesNotExist:
-                        await self.send(text_data=json.dumps({"error": "Parent message does not exist"}))
+                        await self.send_payload({"error": "Parent message does not exist"})
                         return
                     
-                message_id, created_at = await self.save_message(message, message_type, sender, attachment, mentions,parent_message)
+                if settings.CHAT_WRITE_BEHIND:
+                    # Broadcast now, persisted by flush_chat_messages (which also records mentions)
+                    from . import write_behind
+                    message_id = await database_sync_to_async(write_behind.reserve_message_id)()
+                    created_at = await write_behind.enqueue_message(
+                        message_id, self.room.id, sender.id, message_type, message,
+                        attachment=attachment, parent_message_id=parent_message_id, mentions=mentions,
+                    )
+                    notifications = []
+                else:
+                    message_id, created_at, notifications = await self.save_message(message, message_type, sender, attachment, mentions,parent_message)
+                from .utils import get_parent_message_summary
+                parent_summary = await sync_to_async(get_parent_message_summary)(parent_message)
                 try:
                     await self.channel_layer.group_send(
                         self.room_group_name,
-                        {
-                            "type": "chat_message",
+                        events.chat_message({
                             "message": message,
                             "sender": sender_details,
                             "message_type": message_type,
-                            "attachment": attachment,
                             "id": message_id,
+                            "attachment": attachment,
                             "created_at": created_at.isoformat(),
                             "room": self.room_id,
-                            "parent_message_id": parent_message_id,
-                        },
+                            "parent_message": parent_summary,
+                        }),
                     )
-                except Exception as e:
-                    print("Error during group_send:", e)
-                    
-                if mentions:
-                    from User.models import User
-                    from Notification.models import Notification
-                    room_name = await self.get_room_name(self.room_id)
-                    for mentioned_user_id in mentions:
-                        if mentioned_user_id == sender.id:
-                            continue  
-                        try:
-                            user = await sync_to_async(User.objects.get)(id=mentioned_user_id)
-                        except User.DoesNotExist:
-                            continue
-
-                        notification = await sync_to_async(Notification.objects.create)(
-                            user=user,
-                            event_type='chat_mention',
-                            message=f"You were mentioned in {room_name} chat by {sender.first_name}",
-                            is_read=False
-                        )
-                        notification_data = {
-                            "id": notification.id,
-                            "event_type": notification.event_type,
-                            "message": notification.message,
-                            "url": notification.url,
-                            "created_at": notification.created_at.isoformat(),
-                        }
-                        # Send the notification to the mentioned user's notifications group
-                        await self.channel_layer.group_send(
-                            f"notifications_{user.id}",
-                            {
-                                "type": "send_notification",
-                                "notification": notification_data,
-                            }
-                        )
+                except Exception:
+                    logger.exception("Broadcasting message %s to room %s failed", message_id, self.room_id)
+
+                # Push notifications for offline members are delivered in the background
+                run_in_background(
+                    deliver_push_notifications(self.room_id, room_name, sender.id, message)
+                )
+
+                if notifications:
+                    await deliver_mention_notifications(self.channel_layer, notifications)
 
             else:
-                await self.send(text_data=json.dumps({"error": "User is not authenticated"}))
+                await self.send_payload({"error": "User is not authenticated"})
 
         elif action == "edit_message":
             # Handle editing an existing message
@@ -172,69 +332,81 @@ class ChatConsumer(AsyncWebsocketConsumer):
             new_content = text_data_json.get("new_content")
 
             if not message_id or not new_content:
-                await self.send(text_data=json.dumps({
+                await self.send_payload({
                     "error": "Both 'message_id' and 'new_content' are required for editing."
-                }))
+                })
                 return
             edited_message = await self.edit_existing_message(message_id, new_content)
 
             if edited_message:
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {
-                        "type": "chat_message_edited",
+                    events.room_event("chat_message_edited", {
+                        "action": "edited",
                         "id": message_id,
+                        "room": self.room_id,
                         "new_content": new_content,
-                    },
+                    }),
                 )
             else:
-                await self.send(text_data=json.dumps({"error": "Editing failed."}))
+                await self.send_payload({"error": "Editing failed."})
 
         elif action == "react_message":
             message_id = text_data_json.get("message_id")
             reaction_type = text_data_json.get("reaction")
             if not message_id or not reaction_type:
-                await self.send(text_data=json.dumps({
+                await self.send_payload({
                     "error": "'message_id' and 'reaction' are required for react_message."
-                }))
+                })
+                return
+            from .reactions import is_valid_emoji
+            if not is_valid_emoji(reaction_type):
+                await self.send_payload({"error": "'reaction' must be an emoji of at most 32 characters."})
                 return
 
-            updated_message = await self.react_to_message(message_id, reaction_type)
-            if updated_message:
-                # Optionally, broadcast the updated reactions to everyone in the room
+            add = not text_data_json.get("remove", False)
+            result = await self.react_to_message(message_id, reaction_type, add)
+            if result is None:
+                await self.send_payload({"error": "Reaction failed; message not found."})
+            elif result[0]:
+                delta, count = result
+                # Broadcast only what changed; clients apply the delta to their counts
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {
-                        "type": "chat_message_reacted",
+                    events.room_event("chat_message_reacted", {
+                        "action": "reacted",
                         "id": message_id,
-                        "reactions": updated_message.reactions,
-                    },
+                        "room": self.room_id,
+                        "reaction": reaction_type,
+                        "delta": delta,
+                        "count": count,
+                        "user_id": self.user_id,
+                    }),
                 )
-            else:
-                await self.send(text_data=json.dumps({"error": "Reaction failed; message not found."}))
 
         elif action == "pin_message":
             message_id = text_data_json.get("message_id")
             pin = text_data_json.get("pin", True)
             if not message_id:
-                await self.send(text_data=json.dumps({"error": "Message ID is required for pinning."}))
+                await self.send_payload({"error": "Message ID is required for pinning."})
                 return
             
             msg = await self.pin_unpin_message(message_id, pin)
             if msg is None:
-                await self.send(text_data=json.dumps({
+                await self.send_payload({
                     "error": "Pin/unpin failed (maybe no permission or limit reached)."
-                }))
+                })
             else:
                 # Broadcast to everyone in the room
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {
-                        "type": "chat_message_pinned",
-                        "id": message_id,
+                    events.room_event("chat_message_pinned", {
+                        "action":    "message_pinned",
+                        "id":        message_id,
+                        "room":      self.room_id,
                         "is_pinned": pin,
                         "pinned_at": msg.pinned_at.isoformat() if pin else None,
-                    },
+                    }),
                 )
             return 
             
@@ -248,52 +420,50 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 if deletion_success:
                     await self.channel_layer.group_send(
                         self.room_group_name,
-                        {
-                            "type": "chat_message_deleted",
+                        events.room_event("chat_message_deleted", {
+                            "action": "deleted",
                             "id": message_id,
-                        },
+                            "room": self.room_id,
+                        }),
                     )
                 else:
-                    await self.send(text_data=json.dumps({"error": "Deletion failed."}))
+                    await self.send_payload({"error": "Deletion failed."})
             else:
-                await self.send(text_data=json.dumps({"error": "Message ID is required for deletion."}))
+                await self.send_payload({"error": "Message ID is required for deletion."})
 
-        elif action == "typing":
-            sender = self.scope["user"]
-            sender_details = await sync_to_async(self.get_sender_details)(sender)
-            await self.channel_layer.group_send(
+        elif action in ("typing", "stop_typing"):
+            if self.sender_details is None:
+                await self.send_payload({"error": "User is not authenticated"})
+                return
+            # Coalesced per room and flushed as one group_send per window
+            typing_coalescer.update(
+                self.channel_layer,
                 self.room_group_name,
-                {
-                    "type": "chat_typing",
-                    "sender": sender_details,
-                    "is_typing": True,
-                },
+                self.room_id,
+                self.sender_details,
+                is_typing=action == "typing",
             )
 
-        elif action == "stop_typing":
-            sender = self.scope["user"]
-            sender_details = await sync_to_async(self.get_sender_details)(sender)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat_typing",
-                    "sender": sender_details,
-                    "is_typing": False,
-                },
-            )
+        elif action == "mark_read":
+            message_id = text_data_json.get("message_id")
+            if not isinstance(message_id, int):
+                await self.send_payload({"error": "'message_id' is required for mark_read."})
+                return
+            # Throttled: only the highest message id of each window is published
+            self.read_receipts.update(message_id)
 
         else:
-            await self.send(text_data=json.dumps({"error": "Unknown action"}))
+            await self.send_payload({"error": "Unknown action"})
 
 
     @sync_to_async
     def edit_existing_message(self, message_id, new_content):
         from .models import Message  # Adjust the import as needed
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.get(id=message_id, room_id=self.room_id)
             current_user = self.scope["user"]
             # Permission check: allow if the current user is the sender or has special permissions.
-            if message.sender != current_user:
+            if message.sender_id != current_user.id:
                 return None 
             message.edit_message(new_content)
             return message
@@ -304,10 +474,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def delete_existing_message(self, message_id):
         from .models import Message  # Adjust the import as needed
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.get(id=message_id, room_id=self.room_id)
             current_user = self.scope["user"]
             # Permission check: allow if the current user is the sender or has special permissions.
-            if message.sender != current_user:
+            if message.sender_id != current_user.id:
                 return False
             message.delete_message()  # This performs a soft delete (sets is_deleted to True)
             return True
@@ -315,19 +485,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return False
         
     @sync_to_async
-    def react_to_message(self, message_id, reaction_type):
-        from .models import Message
-        try:
-            message = Message.objects.get(id=message_id)
-            # Load existing reactions or initialize an empty dictionary
-            reactions = message.reactions or {}
-            # Update the count for the given reaction type
-            reactions[reaction_type] = reactions.get(reaction_type, 0) + 1
-            message.reactions = reactions
-            message.save()
-            return message
-        except Message.DoesNotExist:
-            return None
+    def react_to_message(self, message_id, reaction_type, add=True):
+        from .reactions import set_reaction
+        return set_reaction(message_id, self.room_id, self.scope["user"], reaction_type, add)
 
     @sync_to_async
     def pin_unpin_message(self, message_id, pin):
@@ -335,13 +495,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
         from django.core.exceptions import ValidationError
 
         try:
-            msg = Message.objects.get(id=message_id)
-            user = self.scope["user"]
+            # Membership was verified at connect; only messages of this room can be pinned
+            msg = Message.objects.get(id=message_id, room_id=self.room_id)
 
-            # Only allow the sender or the room’s creator to pin/unpin
-            if not msg.room.members.filter(id=user.id).exists():
-                return None
-            
             if pin:
                 try:
                     msg.pin()
@@ -355,98 +511,57 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return None
 
 
-    # Receive message from room group
+    async def publish_read_receipt(self, room_id, message_id):
+        """
+        Advance this user's watermark in the room and tell the room, if it moved.
+        """
+        seq = await database_sync_to_async(read_receipts.advance_watermark)(self.user_id, room_id, message_id)
+        if seq is None:
+            return
+        await self.channel_layer.group_send(
+            f"chat_{room_id}",
+            events.room_event("chat_read_receipt", {
+                "action": "read",
+                "room": room_id,
+                "user_id": self.user_id,
+                "message_id": message_id,
+                "seq": seq,
+            }, sender_id=self.user_id),
+        )
+
+    async def chat_room_updated(self, event):
+        """
+        Refresh the cached room context after the room or its membership changed.
+        """
+        if self.user_id in event.get("removed_user_ids", ()) or not event.get("is_active", True):
+            self.room = None
+            await self.close(code=4403)
+            return
+        if "name" in event:
+            self.room.name = event["name"]
+
+    # Receive message from room group. Frames arrive pre-encoded (see Chat.events),
+    # so these handlers only pick the right one and queue it (see Chat.flow_control).
     async def chat_message(self, event):
-        message = event["message"]
-        sender = event["sender"]
-        message_type = event["message_type"]
-        message_id = event['id']
-        created_at = event['created_at']
-        room = event['room']
-        attachment = event.get("attachment", None)
-        parent_message_id = event.get("parent_message_id", None)
-        parent_message = None
-        current_user = self.scope.get("user")
-        is_self = False
-        if current_user and current_user.is_authenticated:
-            is_self = sender.get("id") == current_user.id
-
-        if parent_message_id:
-            from .models import Message
-            try:
-                parent_message_obj = await sync_to_async(
-                    Message.objects.select_related("sender").get
-                )(id=parent_message_id)
-                parent_message = {
-                    "id": parent_message_obj.id,
-                    "content": parent_message_obj.content,
-                    "sender": {
-                        "id": parent_message_obj.sender.id,
-                        "name": parent_message_obj.sender.first_name,
-                        "photo": parent_message_obj.sender.photo.url if parent_message_obj.sender.photo else None,
-                    },
-                    "created_at": parent_message_obj.created_at.isoformat(),
-                }
-            except Message.DoesNotExist:
-                parent_message = None
+        is_self = self.user_id is not None and event["sender_id"] == self.user_id
+        if is_self:
+            self.outbound.put(event["self_frame"], event["self_packed"])
+        else:
+            self.outbound.put(event["frame"], event["packed"])
 
+    async def chat_room_event(self, event):
+        self.outbound.put(event["frame"], event["packed"])
 
-        # Send message to WebSocket
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "message": message,
-                    "sender": sender,
-                    'message_type': message_type,
-                    'id': message_id,
-                    'is_self': is_self,
-                    "attachment": attachment,
-                    'created_at': created_at,
-                    'room': room,
-                    "parent_message": parent_message,
-                }
-            )
-        )
-    
-    async def chat_message_edited(self, event):
-        await self.send(text_data=json.dumps({
-            "action": "edited",
-            "id": event["id"],
-            "new_content": event["new_content"],
-        }))
-
-    async def chat_message_deleted(self, event):
-        await self.send(text_data=json.dumps({
-            "action": "deleted",
-            "id": event["id"],
-        }))
-
-    async def chat_message_reacted(self, event):
-        await self.send(text_data=json.dumps({
-            "action": "reacted",
-            "id": event["id"],
-            "reactions": event["reactions"],
-        }))
+    chat_message_edited = chat_room_event
+    chat_message_deleted = chat_room_event
+    chat_message_reacted = chat_room_event
+    chat_message_pinned = chat_room_event
+    chat_read_receipt = chat_room_event
 
     async def chat_typing(self, event):
-        sender = event["sender"]
-        current_user = self.scope.get("user")
-        if current_user and current_user.is_authenticated and sender["id"] == current_user.id:
-            return
-        
-        await self.send(text_data=json.dumps({
-            "action": "typing",
-            "sender": event["sender"],
-            "is_typing": event["is_typing"],
-        }))
-
-    async def chat_message_pinned(self, event):
-        await self.send(text_data=json.dumps({
-            "action":    "message_pinned",
-            "id":        event["id"],
-            "is_pinned": event["is_pinned"],
-            "pinned_at": event.get("pinned_at"),
-        }))
+        for update in event["updates"]:
+            if self.user_id is None or update["sender_id"] != self.user_id:
+                self.outbound.put(update["frame"], update["packed"], ephemeral=True)
 
     def get_sender_details(self, sender):
         """
@@ -468,31 +583,145 @@ class ChatConsumer(AsyncWebsocketConsumer):
     
     @sync_to_async
     def save_message(self, content, message_type, sender, attachment=None, mentions=None,parent_message=None):
-        from .models import Room, Message  
-        from django.contrib.auth import get_user_model
-        User = get_user_model() 
         """
-        Save the message to the database and return its ID and created timestamp.
+        Save the message to the database and return its ID, created timestamp and the
+        notifications created for the mentioned members.
         """
-        room = Room.objects.get(id=self.room_id)
+        from .utils import create_room_message, record_mentions
 
-        message = Message.objects.create(
-            room=room,
+        # Membership was verified at connect, so the message is inserted without re-checking
+        message = create_room_message(
+            room=self.room,
             sender=sender,
+            check_membership=False,
             message_type=message_type,
             content=content,
             attachment=attachment,
             parent_message=parent_message,
         )
-        if mentions:
-            valid_mentions = room.members.filter(id__in=mentions)
-            message.mentions.set(valid_mentions)
-        return message.id, message.created_at
-    
-    @sync_to_async
-    def get_room_name(self, room_id):
+        notifications = record_mentions(message, mentions, self.room.name) if mentions else []
+        return message.id, message.created_at, notifications
+
+
+class ChatMultiplexConsumer(ChatConsumer):
+    """
+    One socket per user carrying all of their rooms and their notifications, instead of
+    one ChatConsumer socket per open room plus a NotificationConsumer socket.
+
+    The socket joins the group of every active room of the user on connect. Client frames
+    use the ChatConsumer actions with an extra "room" field naming the room they apply to,
+    plus {"action": "subscribe" | "unsubscribe", "room": <id>} to follow or drop a room.
+    Every room frame sent to the client carries "room"; notifications arrive as
+    {"notification": {...}}, as on the notifications socket.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        self.user_id = user.id if user.is_authenticated else None
+        self.heartbeat_task = None
+        self.sender_details = None
+        self.room = None
+        self.connected = False
+        self.rooms = {}          # room id -> Room
+        self.room_receipts = {}  # room id -> ReadReceiptThrottle
+        if self.user_id is None:
+            await self.close(code=4403)
+            return
+
+        self.notification_group = f"notifications_{user.id}"
+        self.sender_details = await sync_to_async(self.get_sender_details)(user)
+        self.start_flow_control(user.id)
+        await presence.connect(user.id, self.channel_name)
+        self.heartbeat_task = run_in_background(self.presence_heartbeat(user.id))
+
+        await self.channel_layer.group_add(self.notification_group, self.channel_name)
+        for room in await self.load_rooms(user):
+            await self.join(room)
+        self.connected = True
+
+        await self.accept_wire()
+
+    async def disconnect(self, close_code):
+        if not getattr(self, "connected", False):
+            return
+        self.connected = False
+        self.heartbeat_task.cancel()
+        self.writer_task.cancel()
+        for room_id in list(self.rooms):
+            await self.leave(room_id)
+        await presence.disconnect(self.user_id, self.channel_name)
+        await self.channel_layer.group_discard(self.notification_group, self.channel_name)
+
+    @database_sync_to_async
+    def load_rooms(self, user):
         from .models import Room
-        room = Room.objects.get(id=room_id)
-        return room.name
-    
+        return list(
+            Room.objects.filter(is_active=True, members=user).only("id", "name", "is_active", "message_seq")
+        )
+
+    async def join(self, room):
+        self.rooms[room.id] = room
+        self.room_receipts[room.id] = read_receipts.ReadReceiptThrottle(partial(self.publish_read_receipt, room.id))
+        await self.channel_layer.group_add(f"chat_{room.id}", self.channel_name)
+
+    async def leave(self, room_id, removed=False):
+        if self.rooms.pop(room_id, None) is None:
+            return
+        typing_coalescer.forget(f"chat_{room_id}", self.user_id)
+        receipts = self.room_receipts.pop(room_id)
+        if removed:
+            # As in ChatConsumer.disconnect, the read position is no longer this user's to move
+            receipts.discard()
+        else:
+            await receipts.close()
+        await self.channel_layer.group_discard(f"chat_{room_id}", self.channel_name)
+
+    async def handle_action(self, text_data_json):
+        action = text_data_json.get("action", "send_message")
+        room_id = text_data_json.get("room")
+        if not isinstance(room_id, int):
+            await self.send_payload({"error": "'room' is required."})
+            return
+
+        if action in ("subscribe", "unsubscribe") and not await self.allow_action(action):
+            return
+
+        if action == "subscribe":
+            if room_id not in self.rooms:
+                room = await self.load_room(self.scope["user"], room_id)
+                if room is None:
+                    await self.send_payload({"error": "Room not found or not a member.", "room": room_id})
+                    return
+                await self.join(room)
+            await self.send_payload({"action": "subscribed", "room": room_id})
+            return
+
+        if action == "unsubscribe":
+            await self.leave(room_id)
+            await self.send_payload({"action": "unsubscribed", "room": room_id})
+            return
+
+        room = self.rooms.get(room_id)
+        if room is None:
+            await self.send_payload({"error": "Not subscribed to this room.", "room": room_id})
+            return
+
+        # Consumers handle one frame at a time, so the single-room protocol can run
+        # against this room's context without interleaving with other frames.
+        self.room, self.room_id, self.room_group_name = room, room.id, f"chat_{room.id}"
+        self.read_receipts = self.room_receipts[room.id]
+        await super().handle_action(text_data_json)
+
+    async def chat_room_updated(self, event):
+        room = self.rooms.get(event.get("room_id"))
+        if room is None:
+            return
+        if self.user_id in event.get("removed_user_ids", ()) or not event.get("is_active", True):
+            await self.leave(room.id, removed=True)
+            await self.send_payload({"action": "unsubscribed", "room": room.id})
+            return
+        if "name" in event:
+            room.name = event["name"]
 
+    async def send_notification(self, event):
+        await self.send_payload({"notification": event["notification"]})
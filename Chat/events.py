@@ -0,0 +1,43 @@
+"""
+Builders for the events broadcast to the chat_<room_id> groups.
+
+Each event carries its WebSocket frame already encoded, as JSON text and as msgpack
+(see core.websocket). The handlers in ChatConsumer only forward the one matching the
+socket's wire format, so broadcasting to a room with N open sockets costs one encode
+per format and event instead of N.
+"""
+import json
+from core.websocket import pack_frame
+
+
+def encode_frame(payload):
+    return json.dumps(payload)
+
+
+def chat_message(payload):
+    """
+    Event for a new message. `is_self` is the only per-recipient field, so both
+    variants are encoded up front and each socket picks one by comparing sender_id.
+    """
+    other, own = {**payload, "is_self": False}, {**payload, "is_self": True}
+    return {
+        "type": "chat_message",
+        "sender_id": payload["sender"]["id"],
+        "frame": encode_frame(other),
+        "packed": pack_frame(other),
+        "self_frame": encode_frame(own),
+        "self_packed": pack_frame(own),
+    }
+
+
+def room_event(event_type, payload, sender_id=None):
+    """
+    Event whose frame is identical for every recipient. `sender_id` lets handlers
+    skip the socket(s) of the user who caused it (e.g. typing indicators).
+    """
+    return {
+        "type": event_type,
+        "sender_id": sender_id,
+        "frame": encode_frame(payload),
+        "packed": pack_frame(payload),
+    }
@@ -0,0 +1,193 @@
+"""
+Rate limiting and backpressure for chat sockets.
+
+Inbound, every client action belongs to an action class with its own token bucket:
+
+  per connection  in-process buckets, checked first, so over-limit frames are rejected
+                  without any I/O
+  per user        Redis buckets shared by all of the user's sockets on every worker,
+                  for the classes that write to the database or fan out
+                  (ratelimit:<user_id>:<class> hashes, updated by a Lua script)
+
+Outbound, frames for a socket go through a bounded OutboundQueue. When a slow client
+falls behind, ephemeral frames (typing) are dropped first; if the queue is still full
+of durable frames, the socket is closed and the client catches up through the sync
+endpoint when it reconnects.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from redis.exceptions import RedisError
+from core.redis_client import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+ACTION_CLASSES = {
+    "send_message": "message",
+    "edit_message": "edit",
+    "delete_message": "edit",
+    "pin_message": "edit",
+    "react_message": "reaction",
+    "typing": "typing",
+    "stop_typing": "typing",
+    "mark_read": "receipt",
+    "subscribe": "subscription",
+    "unsubscribe": "subscription",
+}
+DEFAULT_CLASS = "other"
+
+# class -> (burst capacity, tokens refilled per second)
+CONNECTION_BUDGETS = {
+    "message": (10, 2.0),
+    "edit": (10, 1.0),
+    "reaction": (20, 4.0),
+    "typing": (20, 5.0),
+    "receipt": (20, 5.0),
+    "subscription": (50, 5.0),
+    DEFAULT_CLASS: (10, 2.0),
+}
+USER_BUDGETS = {
+    "message": (20, 2.0),
+    "edit": (20, 1.0),
+    "reaction": (40, 4.0),
+}
+# Rejected without telling the client; they are sent again anyway
+SILENT_CLASSES = {"typing", "receipt"}
+
+OUTBOUND_QUEUE_SIZE = 256
+CLOSE_CODE_TOO_SLOW = 4008
+
+# KEYS[1] = bucket; ARGV[1] = capacity, ARGV[2] = rate, ARGV[3] = now
+# Returns {1, "0"} if a token was taken, otherwise {0, seconds until the next token}
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+if allowed == 1 then
+    return {1, "0"}
+end
+return {0, tostring((1 - tokens) / rate)}
+"""
+
+
+def action_class(action):
+    return ACTION_CLASSES.get(action, DEFAULT_CLASS)
+
+
+def bucket_key(user_id, action_class):
+    return f"ratelimit:{user_id}:{action_class}"
+
+
+class TokenBucket:
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self):
+        """
+        Take a token. Returns 0 on success, otherwise the seconds until one is available.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ActionLimiter:
+    """
+    Rate limits of one socket of `user_id`.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.buckets = {name: TokenBucket(*budget) for name, budget in CONNECTION_BUDGETS.items()}
+
+    async def check(self, action):
+        """
+        Return 0 if the action may run, otherwise the seconds the client should wait.
+        """
+        name = action_class(action)
+        retry_after = self.buckets[name].take()
+        if retry_after or name not in USER_BUDGETS:
+            return retry_after
+
+        capacity, rate = USER_BUDGETS[name]
+        try:
+            allowed, retry_after = await get_async_redis().eval(
+                TAKE_SCRIPT, 1, bucket_key(self.user_id, name), capacity, rate, time.time()
+            )
+        except RedisError:
+            # The per-connection budget still applies; do not fail chat on a Redis outage
+            logger.exception("Rate limit check failed for user %s", self.user_id)
+            return 0
+        return 0 if int(allowed) else float(retry_after)
+
+    @staticmethod
+    def is_silent(action):
+        return action_class(action) in SILENT_CLASSES
+
+
+class OutboundQueue:
+    """
+    Bounded queue of frames waiting to be written to one socket by a single writer
+    task. `send` is an async callable taking one queued frame's arguments; `on_overflow`
+    is awaited once when a durable frame cannot be queued.
+    """
+
+    def __init__(self, send, on_overflow, maxsize=OUTBOUND_QUEUE_SIZE):
+        self.send = send
+        self.on_overflow = on_overflow
+        self.maxsize = maxsize
+        self.frames = deque()  # (ephemeral, args)
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.overflowed = False
+
+    def put(self, *args, ephemeral=False):
+        """
+        Queue a frame. Never awaits.
+        """
+        if self.overflowed:
+            return
+        if len(self.frames) >= self.maxsize:
+            self.dropped += 1
+            if ephemeral:
+                return
+            if not self.evict_ephemeral():
+                self.overflowed = True
+                asyncio.ensure_future(self.on_overflow())
+                return
+        self.frames.append((ephemeral, args))
+        self.ready.set()
+
+    def evict_ephemeral(self):
+        for index, (ephemeral, _) in enumerate(self.frames):
+            if ephemeral:
+                del self.frames[index]
+                return True
+        return False
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            while self.frames:
+                _, args = self.frames.popleft()
+                await self.send(*args)
+            self.ready.clear()
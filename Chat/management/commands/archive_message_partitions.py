@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from Chat import partitions
+from Chat.models import Message, MessageReaction, Room
+
+
+class Command(BaseCommand):
+    help = (
+        "Detach the Chat_message partitions older than --older-than months. Detached "
+        "partitions are moved to the chat_archive schema, or dropped with --drop."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=12, help="Age in months of the partitions to detach.")
+        parser.add_argument("--drop", action="store_true", help="Drop the partitions instead of archiving them.")
+        parser.add_argument("--dry-run", action="store_true", help="Only list the partitions that would be detached.")
+
+    def handle(self, *args, **options):
+        cutoff = partitions.add_months(partitions.month_start(timezone.now()), -options["older_than"])
+        with connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                self.stderr.write("Chat_message is not partitioned.")
+                return
+            old = sorted((month, name) for month, name in partitions.list_partitions(cursor).items() if month < cutoff)
+
+        for month, name in old:
+            if options["dry_run"]:
+                self.stdout.write(f"Would detach {name}")
+                continue
+            self.detach(name, drop=options["drop"])
+            self.stdout.write(f"{'Dropped' if options['drop'] else 'Archived'} {name}")
+
+        self.stdout.write(self.style.SUCCESS(f"{len(old)} partitions older than {cutoff:%Y-%m} processed."))
+
+    def detach(self, name, drop):
+        quote = connection.ops.quote_name
+        partition_ids = f"SELECT id FROM {quote(name)}"
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Nothing references messages at the database level; apply on_delete by hand
+            cursor.execute(
+                f"UPDATE {quote(Room._meta.db_table)} SET last_message_id = NULL WHERE last_message_id IN ({partition_ids})"
+            )
+            if drop:
+                cursor.execute(
+                    f"DELETE FROM {quote(MessageReaction._meta.db_table)} WHERE message_id IN ({partition_ids})"
+                )
+                cursor.execute(
+                    f"DELETE FROM {quote(Message.mentions.through._meta.db_table)} WHERE message_id IN ({partition_ids})"
+                )
+
+            cursor.execute(f"ALTER TABLE {quote(partitions.parent_table())} DETACH PARTITION {quote(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {quote(name)}")
+            else:
+                # The archive must not keep rooms and users from being deleted
+                cursor.execute(
+                    "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+                    [quote(name)],
+                )
+                for (constraint,) in cursor.fetchall():
+                    cursor.execute(f"ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(constraint)}")
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote(partitions.ARCHIVE_SCHEMA)}")
+                cursor.execute(f"ALTER TABLE {quote(name)} SET SCHEMA {quote(partitions.ARCHIVE_SCHEMA)}")
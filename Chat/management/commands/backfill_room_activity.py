@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef
+from Chat.models import Room, Message, UserRoomStatus, count_subquery
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill Message.seq, the Room activity counters (message_seq, last_message, "
+        "last_message_at) and UserRoomStatus.last_read_seq from existing messages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", type=int, nargs="*", help="Only backfill these room IDs.")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rooms = Room.objects.order_by("id")
+        if options["room"]:
+            rooms = rooms.filter(id__in=options["room"])
+
+        for room_id in rooms.values_list("id", flat=True):
+            total = self.backfill_room(room_id, options["batch_size"])
+            self.stdout.write(f"Room {room_id}: {total} messages")
+
+        self.stdout.write(self.style.SUCCESS("Room activity backfill complete."))
+
+    def backfill_room(self, room_id, batch_size):
+        with transaction.atomic():
+            # Lock the room so no message is posted while its sequence is rebuilt
+            room = Room.objects.select_for_update().get(id=room_id)
+
+            message_ids = list(
+                Message.objects.filter(room=room).order_by("created_at", "id").values_list("id", flat=True)
+            )
+            Message.objects.bulk_update(
+                [Message(id=message_id, seq=seq) for seq, message_id in enumerate(message_ids, start=1)],
+                ["seq"],
+                batch_size=batch_size,
+            )
+
+            # An update rather than a save: open sockets have nothing to refresh
+            last_message = Message.objects.filter(room=room).order_by("-created_at", "-id").first()
+            Room.objects.filter(id=room.id).update(
+                message_seq=len(message_ids),
+                last_message=last_message,
+                last_message_at=last_message.created_at if last_message else None,
+            )
+
+            # A read position is the number of messages posted up to the last_read timestamp
+            UserRoomStatus.objects.filter(room=room, last_read__isnull=False).update(
+                last_read_seq=count_subquery(
+                    Message.objects.filter(room=room, created_at__lte=OuterRef("last_read"))
+                )
+            )
+            UserRoomStatus.objects.filter(room=room, last_read__isnull=True).update(last_read_seq=0)
+
+        return len(message_ids)
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from redis.exceptions import RedisError
+from Chat import events
+from core.redis_client import get_redis
+from core.websocket import pack_frame
+from .bench_chat_wire import sample_events
+
+# Keeps the benchmark's keys and channels apart from the live ones
+BENCH_PREFIX = "bench-layers"
+
+
+def chat_event_mix():
+    """
+    The frames of bench_chat_wire as the group events ChatConsumer broadcasts.
+    """
+    mix = []
+    for payload in sample_events():
+        if "notification" in payload:
+            continue
+        if "sender" in payload and "message" in payload:
+            mix.append(events.chat_message(payload))
+        elif payload.get("action") == "typing":
+            mix.append({"type": "chat_typing", "updates": [{
+                "sender_id": payload["sender"]["id"],
+                "frame": events.encode_frame(payload),
+                "packed": pack_frame(payload),
+            }]})
+        else:
+            mix.append(events.room_event("chat_message_reacted", payload))
+    return mix
+
+
+def redis_calls():
+    """
+    Total number of commands the Redis server has run, or None if it is not available.
+    """
+    try:
+        stats = get_redis().info("commandstats")
+    except RedisError:
+        return None
+    return sum(command["calls"] for command in stats.values())
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the Redis channel layers (see CHANNEL_LAYER in core/settings.py) on the chat "
+        "event mix: group_send cost, time until every socket of the room has the event, and "
+        "Redis commands per event."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500], help="Sockets per room.")
+        parser.add_argument("--events", type=int, default=200, help="Events broadcast per measurement.")
+        parser.add_argument(
+            "--layers", nargs="+", default=sorted(settings.CHANNEL_LAYER_CONFIGS),
+            choices=sorted(settings.CHANNEL_LAYER_CONFIGS), help="Layers to compare.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'layer':>8} {'sockets':>8} {'send us/event':>14} {'delivered ms p50':>17} "
+            f"{'delivered ms p99':>17} {'redis cmds/event':>17}"
+        )
+        for name in options["layers"]:
+            for size in options["sizes"]:
+                send, p50, p99, calls = asyncio.run(self.measure(name, size, options["events"]))
+                calls = f"{calls:.1f}" if calls is not None else "n/a"
+                self.stdout.write(
+                    f"{name:>8} {size:>8} {send * 1e6:>14.1f} {p50 * 1e3:>17.2f} {p99 * 1e3:>17.2f} {calls:>17}"
+                )
+
+    async def measure(self, name, size, n_events):
+        config = settings.CHANNEL_LAYER_CONFIGS[name]
+        layer = import_string(config["BACKEND"])(**{**config.get("CONFIG", {}), "prefix": BENCH_PREFIX})
+        group = "chat_bench"
+        channels = [await layer.new_channel() for _ in range(size)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+
+        mix = chat_event_mix()
+        send_time, delivered = 0.0, []
+        calls_before = await asyncio.to_thread(redis_calls)
+        for i in range(n_events):
+            start = time.perf_counter()
+            await layer.group_send(group, mix[i % len(mix)])
+            send_time += time.perf_counter() - start
+            # Every socket of the room drains its copy, as the consumers would
+            await asyncio.gather(*[layer.receive(channel) for channel in channels])
+            delivered.append(time.perf_counter() - start)
+        calls_after = await asyncio.to_thread(redis_calls)
+
+        for channel in channels:
+            await layer.group_discard(group, channel)
+        for close in ("flush", "close_pools"):
+            if hasattr(layer, close):
+                await getattr(layer, close)()
+
+        delivered.sort()
+        calls = None
+        if calls_before is not None and calls_after is not None:
+            calls = (calls_after - calls_before) / n_events
+        return (
+            send_time / n_events,
+            delivered[len(delivered) // 2],
+            delivered[min(len(delivered) - 1, int(len(delivered) * 0.99))],
+            calls,
+        )
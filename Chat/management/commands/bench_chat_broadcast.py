@@ -0,0 +1,96 @@
+import asyncio
+import json
+import time
+from django.core.management.base import BaseCommand
+from Chat import events
+from Chat.consumers import ChatConsumer
+from Chat.flow_control import OutboundQueue
+
+
+def sample_payload(sender_id):
+    return {
+        "message": "Hey everyone, the meeting moved to 5pm in the seminar hall. Bring your laptops!",
+        "sender": {
+            "name": "Anagh",
+            "photo": "https://res.cloudinary.com/demo/image/upload/v1700000000/profile/abcdef.jpg",
+            "id": sender_id,
+            "role": "member",
+        },
+        "message_type": "text",
+        "id": 123456,
+        "attachment": None,
+        "created_at": "2025-06-07T14:13:07.512345+05:30",
+        "room": 42,
+        "parent_message": {
+            "id": 123400,
+            "content": "When is the meeting?",
+            "sender": {"id": 7, "name": "Riya", "photo": None},
+            "created_at": "2025-06-07T14:10:01.000000+05:30",
+        },
+    }
+
+
+async def legacy_chat_message(consumer, event):
+    """
+    The per-socket handler as it was before frames were pre-encoded: every recipient
+    rebuilds the frame and runs json.dumps on it.
+    """
+    is_self = event["sender"].get("id") == consumer.user_id
+    await consumer.send(text_data=json.dumps({
+        "message": event["message"],
+        "sender": event["sender"],
+        "message_type": event["message_type"],
+        "id": event["id"],
+        "is_self": is_self,
+        "attachment": event.get("attachment"),
+        "created_at": event["created_at"],
+        "room": event["room"],
+        "parent_message": event.get("parent_message"),
+    }))
+
+
+class Command(BaseCommand):
+    help = "Measure the per-recipient CPU cost of broadcasting a chat message, before and after serialize-once frames."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Sockets per room.")
+        parser.add_argument("--events", type=int, default=200, help="Broadcasts per measurement.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'sockets':>8} {'before us/recipient':>20} {'after us/recipient':>20} {'speedup':>8}")
+        for size in options["sizes"]:
+            before, after = asyncio.run(self.measure(size, options["events"]))
+            self.stdout.write(f"{size:>8} {before:>20.2f} {after:>20.2f} {before / after:>7.1f}x")
+
+    async def measure(self, size, n_events):
+        consumers = []
+        for user_id in range(1, size + 1):
+            consumer = ChatConsumer()
+            consumer.user_id = user_id
+            consumer.send = self.discard
+            # Nothing drains the queue here; size it to hold every frame of the run
+            consumer.outbound = OutboundQueue(consumer.send_frame, None, maxsize=n_events)
+            consumers.append(consumer)
+
+        payload = sample_payload(sender_id=1)
+        legacy_event = {"type": "chat_message", **payload}
+
+        start = time.process_time()
+        for _ in range(n_events):
+            for consumer in consumers:
+                await legacy_chat_message(consumer, legacy_event)
+        before = time.process_time() - start
+
+        start = time.process_time()
+        for _ in range(n_events):
+            event = events.chat_message(payload)
+            for consumer in consumers:
+                await consumer.chat_message(event)
+        after = time.process_time() - start
+
+        per_recipient = 1e6 / (n_events * size)
+        return before * per_recipient, after * per_recipient
+
+    @staticmethod
+    async def discard(text_data=None, bytes_data=None, close=False):
+        pass
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import random
+import time
+import tracemalloc
+import uuid
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from Chat.models import Room
+
+User = get_user_model()
+
+LAYERS = {
+    "memory": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    **settings.CHANNEL_LAYER_CONFIGS,
+}
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class QueryCounter:
+    """
+    Count the SQL statements run on every database connection, including the ones
+    opened by the database_sync_to_async threads.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self):
+        for conn in connections.all():
+            conn.execute_wrappers.append(self)
+        connection_created.connect(self.connection_created)
+
+    def connection_created(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the chat WebSocket stack in-process: boot core.asgi.application against a "
+        "seeded test database, connect --users sockets spread over --rooms rooms and have every "
+        "user send at --rate messages per second. Reports connect time, send to receive latency "
+        "percentiles, SQL statements and memory per connection. Presence and rate limits still "
+        "use REDIS_URL, so point it at a local Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100, help="Sockets to open, one user each.")
+        parser.add_argument("--rooms", type=int, default=10, help="Rooms the users are spread over.")
+        parser.add_argument("--rate", type=float, default=0.5, help="Messages per second sent by each user.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds of sending.")
+        parser.add_argument("--layer", choices=sorted(LAYERS), default="memory", help="Channel layer to use.")
+        parser.add_argument("--keepdb", action="store_true", help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            with override_settings(CHANNEL_LAYERS={"default": LAYERS[options["layer"]]}):
+                from channels.layers import channel_layers
+                channel_layers.backends = {}
+
+                sockets = self.seed(options["users"], options["rooms"])
+                counter = QueryCounter()
+                counter.install()
+                stats = asyncio.run(self.run(sockets, options["rate"], options["duration"], counter))
+                self.report(options, stats)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keepdb"])
+
+    def seed(self, n_users, n_rooms):
+        """
+        Create the users, their tokens and the rooms. Returns [(room id, token key), ...].
+        """
+        run = uuid.uuid4().hex[:8]
+        users = User.objects.bulk_create([
+            User(email=f"bench-{run}-{i}@akgec.ac.in", first_name=f"Bench {i}", role="member", year="2nd")
+            for i in range(n_users)
+        ])
+        tokens = Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users])
+        rooms = [
+            Room.objects.create(name=f"bench-{run}-{i}", created_by=users[i % n_users])
+            for i in range(n_rooms)
+        ]
+        Room.members.through.objects.bulk_create([
+            Room.members.through(room_id=rooms[i % n_rooms].id, user_id=user.id)
+            for i, user in enumerate(users)
+        ])
+        return [(rooms[i % n_rooms].id, token.key) for i, token in enumerate(tokens)]
+
+    async def run(self, sockets, rate, duration, counter):
+        from channels.testing import WebsocketCommunicator
+        from core.asgi import application
+
+        stats = {"connect": [], "latency": [], "sent": 0, "expected": 0, "rate_limited": 0}
+        room_sizes = {}
+        for room_id, _ in sockets:
+            room_sizes[room_id] = room_sizes.get(room_id, 0) + 1
+
+        async def connect(room_id, token):
+            communicator = WebsocketCommunicator(application, f"/ws/chat/{room_id}/?token={token}")
+            start = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=30)
+            stats["connect"].append(time.perf_counter() - start)
+            if not connected:
+                raise RuntimeError(f"Socket for room {room_id} was refused")
+            return room_id, communicator
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        communicators = []
+        for batch in range(0, len(sockets), 50):
+            communicators += await asyncio.gather(*[connect(*socket) for socket in sockets[batch:batch + 50]])
+        stats["memory"] = (tracemalloc.get_traced_memory()[0] - baseline) / len(sockets)
+        tracemalloc.stop()
+        stats["connect_queries"] = counter.count
+
+        sent_at = {}
+
+        async def read(communicator):
+            while True:
+                try:
+                    output = await communicator.receive_output(timeout=60)
+                except asyncio.TimeoutError:
+                    continue
+                received = time.perf_counter()
+                frame = json.loads(output.get("text") or "{}")
+                if frame.get("error") == "Rate limit exceeded.":
+                    stats["rate_limited"] += 1
+                elif frame.get("message") in sent_at:
+                    stats["latency"].append(received - sent_at[frame["message"]])
+
+        async def send(room_id, communicator, end):
+            await asyncio.sleep(random.uniform(0, 1 / rate))
+            while time.perf_counter() < end:
+                message = f"bench:{uuid.uuid4().hex}"
+                sent_at[message] = time.perf_counter()
+                await communicator.send_to(text_data=json.dumps({"action": "send_message", "message": message}))
+                stats["sent"] += 1
+                stats["expected"] += room_sizes[room_id]
+                await asyncio.sleep(random.expovariate(rate))
+
+        readers = [asyncio.ensure_future(read(communicator)) for _, communicator in communicators]
+        end = time.perf_counter() + duration
+        await asyncio.gather(*[send(room_id, communicator, end) for room_id, communicator in communicators])
+        # Let the last broadcasts arrive
+        await asyncio.sleep(2)
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        stats["queries"] = counter.count - stats["connect_queries"]
+        for _, communicator in communicators:
+            await communicator.disconnect()
+        return stats
+
+    def report(self, options, stats):
+        ms = lambda seconds: f"{seconds * 1000:.1f} ms"
+        connect, latency = stats["connect"], stats["latency"]
+        self.stdout.write(
+            f"{options['users']} sockets in {options['rooms']} rooms, {options['rate']} msg/s per user "
+            f"for {options['duration']} s, {options['layer']} channel layer"
+        )
+        self.stdout.write(
+            f"connect    p50 {ms(percentile(connect, 0.5))}  p99 {ms(percentile(connect, 0.99))}  "
+            f"max {ms(max(connect))}"
+        )
+        self.stdout.write(
+            f"latency    p50 {ms(percentile(latency, 0.5))}  p90 {ms(percentile(latency, 0.9))}  "
+            f"p99 {ms(percentile(latency, 0.99))}  max {ms(max(latency, default=float('nan')))}"
+        )
+        self.stdout.write(
+            f"messages   {stats['sent']} sent, {len(latency)}/{stats['expected']} deliveries, "
+            f"{stats['rate_limited']} rate limited"
+        )
+        per_message = stats["queries"] / stats["sent"] if stats["sent"] else float("nan")
+        self.stdout.write(
+            f"queries    {stats['connect_queries'] / options['users']:.1f} per connect, "
+            f"{per_message:.1f} per message sent"
+        )
+        self.stdout.write(f"memory     {stats['memory'] / 1024:.1f} KiB per connection (tracemalloc)")
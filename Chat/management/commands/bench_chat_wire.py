@@ -0,0 +1,65 @@
+import json
+import time
+from django.core.management.base import BaseCommand
+from core.websocket import Deflater, pack_frame
+from .bench_chat_broadcast import sample_payload
+
+
+def sample_events():
+    """
+    A typical mix of frames on a chat socket, cycled by the benchmark.
+    """
+    message = {**sample_payload(sender_id=1), "is_self": False}
+    return [
+        message,
+        {**message, "id": 123457, "message": "On my way.", "parent_message": None},
+        {"action": "typing", "room": 42, "sender": message["sender"], "is_typing": True},
+        {"action": "reacted", "id": 123456, "room": 42, "reaction": "👍", "delta": 1, "count": 3, "user_id": 7},
+        {"action": "read", "room": 42, "user_id": 7, "message_id": 123457, "seq": 981},
+        {"notification": {
+            "id": 5512,
+            "event_type": "chat_mention",
+            "message": "You were mentioned in Core Team chat by Anagh",
+            "url": None,
+            "created_at": "2025-06-07T14:13:07.612345+05:30",
+        }},
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare bytes on the wire and encode cost of the WebSocket wire formats (see core.websocket)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--frames", type=int, default=10000, help="Frames encoded per format.")
+
+    def handle(self, *args, **options):
+        frames = options["frames"]
+        samples = sample_events()
+        stream = [samples[i % len(samples)] for i in range(frames)]
+
+        formats = [
+            ("json", lambda: lambda payload: json.dumps(payload).encode()),
+            ("msgpack", lambda: pack_frame),
+            ("msgpack.deflate", lambda: self.deflating()),
+        ]
+        results = [(name, *self.measure(make_encoder(), stream)) for name, make_encoder in formats]
+
+        json_bytes = results[0][1]
+        self.stdout.write(f"{'format':>16} {'bytes/frame':>12} {'vs json':>8} {'encode us/frame':>16}")
+        for name, size, cost in results:
+            self.stdout.write(f"{name:>16} {size:>12.1f} {size / json_bytes:>7.0%} {cost:>16.2f}")
+
+    @staticmethod
+    def deflating():
+        # One compression stream per connection, like the consumers keep
+        deflater = Deflater()
+        return lambda payload: deflater.compress(pack_frame(payload))
+
+    @staticmethod
+    def measure(encode, stream):
+        total = 0
+        start = time.process_time()
+        for payload in stream:
+            total += len(encode(payload))
+        elapsed = time.process_time() - start
+        return total / len(stream), elapsed * 1e6 / len(stream)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from Chat import partitions
+
+
+class Command(BaseCommand):
+    help = "Create the monthly Chat_message partitions of the current and upcoming months. Run daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ahead", type=int, default=partitions.PARTITIONS_AHEAD,
+            help="Number of months after the current one to create partitions for.",
+        )
+
+    def handle(self, *args, **options):
+        created = partitions.ensure_partitions(ahead=options["ahead"])
+        for name in created:
+            self.stdout.write(f"Created {name}")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created."))
@@ -0,0 +1,124 @@
+import socket
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from redis.exceptions import ResponseError
+from core.redis_client import get_redis
+from Chat import write_behind
+from Chat.consumers import deliver_mention_notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Persist chat messages queued by the write-behind path (CHAT_WRITE_BEHIND) in "
+        "batches. Run one or more flushers; each needs a distinct --consumer name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumer", default=socket.gethostname(), help="Consumer name within the group.")
+        parser.add_argument("--batch-size", type=int, default=500, help="Maximum messages per insert batch.")
+        parser.add_argument("--block-ms", type=int, default=200, help="How long to wait for new messages.")
+        parser.add_argument(
+            "--min-idle-ms", type=int, default=30000,
+            help="Claim messages left pending by another flusher for at least this long.",
+        )
+        parser.add_argument("--once", action="store_true", help="Exit once the stream is drained.")
+
+    def handle(self, *args, **options):
+        self.client = get_redis()
+        self.stream = settings.CHAT_MESSAGE_STREAM
+        self.dead_letter_stream = settings.CHAT_MESSAGE_DEAD_LETTER_STREAM
+        self.consumer = options["consumer"]
+        self.batch_size = options["batch_size"]
+
+        try:
+            self.client.xgroup_create(self.stream, write_behind.CONSUMER_GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        # Entries this consumer read but never acknowledged (crash mid-batch)
+        total = self.drain("0")
+        total += self.claim_abandoned(options["min_idle_ms"])
+        self.stdout.write(f"Recovered {total} pending messages.")
+
+        while True:
+            flushed = self.flush(">", block=options["block_ms"])
+            if flushed:
+                self.stdout.write(f"Flushed {flushed} messages.")
+            elif options["once"]:
+                break
+            else:
+                self.claim_abandoned(options["min_idle_ms"])
+
+    def drain(self, start_id):
+        total = 0
+        while True:
+            flushed = self.flush(start_id)
+            if not flushed:
+                return total
+            total += flushed
+
+    def claim_abandoned(self, min_idle_ms):
+        total = 0
+        cursor = "0-0"
+        while True:
+            cursor, entries, *_ = self.client.xautoclaim(
+                self.stream, write_behind.CONSUMER_GROUP, self.consumer,
+                min_idle_time=min_idle_ms, start_id=cursor, count=self.batch_size,
+            )
+            total += self.persist(entries)
+            if cursor == "0-0":
+                return total
+
+    def flush(self, start_id, block=None):
+        response = self.client.xreadgroup(
+            write_behind.CONSUMER_GROUP, self.consumer, {self.stream: start_id},
+            count=self.batch_size, block=block,
+        )
+        if not response:
+            return 0
+        _, entries = response[0]
+        return self.persist(entries)
+
+    def persist(self, entries):
+        if not entries:
+            return 0
+        fields_by_id = dict(entries)
+        decoded, failed = [], []
+        for stream_id, fields in entries:
+            try:
+                decoded.extend(write_behind.decode_entries([(stream_id, fields)]))
+            except write_behind.UNPERSISTABLE_ERRORS as e:
+                failed.append((stream_id, e))
+
+        try:
+            _, notifications = write_behind.persist_batch([entry for _, entry in decoded])
+        except write_behind.UNPERSISTABLE_ERRORS:
+            # One bad entry rolls back the whole batch; find it by retrying them one by one
+            notifications = []
+            for stream_id, entry in decoded:
+                try:
+                    _, entry_notifications = write_behind.persist_batch([entry])
+                except write_behind.UNPERSISTABLE_ERRORS as e:
+                    failed.append((stream_id, e))
+                else:
+                    notifications.extend(entry_notifications)
+
+        # Only acknowledge once the batch has committed
+        stream_ids = [stream_id for stream_id, _ in entries]
+        with self.client.pipeline(transaction=True) as pipe:
+            for stream_id, error in failed:
+                pipe.xadd(self.dead_letter_stream, {
+                    **(fields_by_id[stream_id] or {}), "stream_id": stream_id, "error": repr(error),
+                })
+            pipe.xack(self.stream, write_behind.CONSUMER_GROUP, *stream_ids)
+            pipe.xdel(self.stream, *stream_ids)
+            pipe.execute()
+        for stream_id, error in failed:
+            self.stderr.write(f"Moved message {stream_id} to {self.dead_letter_stream}: {error!r}")
+
+        if notifications:
+            async_to_sync(deliver_mention_notifications)(get_channel_layer(), notifications)
+        return len(stream_ids)
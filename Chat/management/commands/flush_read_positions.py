@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from Chat import read_state
+
+
+class Command(BaseCommand):
+    help = (
+        "Persist the read positions recorded in Redis by the mark-as-read endpoints "
+        "(see Chat.read_state) every --interval seconds. Not needed when the "
+        "Chat.tasks.flush_read_positions Celery task is scheduled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between flushes.")
+        parser.add_argument("--once", action="store_true", help="Flush once and exit.")
+
+    def handle(self, *args, **options):
+        while True:
+            flushed = read_state.flush_pending()
+            if flushed:
+                self.stdout.write(f"Flushed {flushed} read positions.")
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
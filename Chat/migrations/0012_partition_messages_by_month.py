@@ -0,0 +1,90 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def partition_message_table(apps, schema_editor):
+    """
+    Rebuild Chat_message as a table partitioned by month of created_at and copy the
+    existing rows into it. Holds an exclusive lock on the table while rows are copied.
+    """
+    from Chat import partitions
+
+    Message = apps.get_model("Chat", "Message")
+    quote = schema_editor.quote_name
+    table = Message._meta.db_table
+    legacy = f"{table}_unpartitioned"
+    sequence = f"{table}_id_seq"
+
+    with schema_editor.connection.cursor() as cursor:
+        if partitions.is_partitioned(cursor):
+            return
+
+        cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+            f"INCLUDING GENERATED) PARTITION BY RANGE (created_at)"
+        )
+        cursor.execute(f"CREATE TABLE {quote(partitions.default_partition())} PARTITION OF {quote(table)} DEFAULT")
+
+        cursor.execute(f"SELECT min(created_at), max(id) FROM {quote(legacy)}")
+        oldest, max_id = cursor.fetchone()
+        month = partitions.month_start(oldest or timezone.now())
+        last = partitions.add_months(partitions.month_start(timezone.now()), partitions.PARTITIONS_AHEAD)
+        while month <= last:
+            partitions.create_partition(cursor, month)
+            month = partitions.add_months(month, 1)
+
+        columns = ", ".join(quote(column) for column in partitions.insertable_columns(cursor, legacy))
+        cursor.execute(f"INSERT INTO {quote(table)} ({columns}) SELECT {columns} FROM {quote(legacy)}")
+        # Also drops the identity sequence of the old id column
+        cursor.execute(f"DROP TABLE {quote(legacy)}")
+
+        # Identity columns are not supported on partitioned tables; use an owned sequence
+        cursor.execute(f"CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.id")
+        cursor.execute("SELECT setval(%s, %s, %s)", [quote(sequence), max_id or 1, max_id is not None])
+        cursor.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN id SET DEFAULT nextval(%s::regclass)", [quote(sequence)])
+        # The partition key has to be part of the primary key
+        cursor.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(table + '_pkey')} PRIMARY KEY (id, created_at)")
+
+    for sql in schema_editor._model_indexes_sql(Message):
+        schema_editor.execute(sql)
+    for field in Message._meta.local_fields:
+        if field.remote_field and field.db_constraint:
+            schema_editor.execute(schema_editor._create_fk_sql(Message, field, "_fk_%(to_table)s_%(to_column)s"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Chat', '0011_room_trigram_search_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='mentions',
+            field=models.ManyToManyField(blank=True, db_constraint=False, related_name='mentioned_in', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='parent_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='Chat.message'),
+        ),
+        migrations.AlterField(
+            model_name='messagereaction',
+            name='message',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='user_reactions', to='Chat.message'),
+        ),
+        migrations.AlterField(
+            model_name='room',
+            name='last_message',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='Chat.message'),
+        ),
+        # Reversing leaves the table partitioned, which the ORM works with either way
+        migrations.RunPython(partition_message_table, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,61 @@
 from django.utils import timezone
 from django.db import models
+from django.db.models import F, Func, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from cloudinary.models import CloudinaryField
 from django.conf import settings
+from core.search import trigram_index
 
 User = settings.AUTH_USER_MODEL
 
+# Text search configuration of Message.search_vector; queries must use the same one
+MESSAGE_SEARCH_CONFIG = "english"
+
+
+def count_subquery(queryset):
+    """
+    Wrap a queryset in a scalar "SELECT COUNT(*)" subquery usable in annotations.
+    """
+    return Coalesce(
+        Subquery(
+            queryset.order_by().annotate(total=Func(F("pk"), function="COUNT")).values("total"),
+            output_field=models.IntegerField(),
+        ),
+        0,
+    )
+
+
+class RoomQuerySet(models.QuerySet):
+    def inbox_for(self, user):
+        """
+        Annotate every room with the inbox data of `user` in a single SQL statement:
+
+          inbox_last_message_id    id of the latest message in the room
+          inbox_last_activity      time of the latest message (room creation if empty)
+          inbox_last_read          the user's last_read timestamp
+          inbox_last_read_message_id  the last message the user has read
+          inbox_unread_count       messages the user has not read yet
+
+        Everything is read from the room's activity counters and the user's status row,
+        so no message rows are scanned. Rooms are ordered by latest activity.
+        """
+        status = UserRoomStatus.objects.filter(room=OuterRef("pk"), user=user)
+
+        return self.annotate(
+            inbox_last_message_id=F("last_message_id"),
+            inbox_last_activity=Coalesce(F("last_message_at"), F("created_at")),
+            inbox_last_read=Subquery(status.values("last_read")[:1]),
+            inbox_last_read_seq=Coalesce(Subquery(status.values("last_read_seq")[:1]), 0),
+        ).annotate(
+            inbox_last_read_message_id=Subquery(
+                Message.objects.filter(room=OuterRef("pk"), seq=OuterRef("inbox_last_read_seq")).values("id")[:1]
+            ),
+            inbox_unread_count=Greatest(F("message_seq") - F("inbox_last_read_seq"), 0),
+        ).order_by("-inbox_last_activity")
+
+
 class Room(models.Model):
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True, null=True)
@@ -18,10 +69,54 @@ class Room(models.Model):
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="created_rooms"
     )
+    # Activity counters, maintained by Chat.utils.create_room_message
+    # References to Message carry no database constraint: Chat_message is partitioned
+    # (see Chat.partitions) and PostgreSQL cannot point a foreign key at it. Django still
+    # applies on_delete itself.
+    last_message = models.ForeignKey(
+        "Message", on_delete=models.SET_NULL, related_name="+", blank=True, null=True, db_constraint=False
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    message_seq = models.PositiveBigIntegerField(default=0)  # Number of messages ever posted
+
+    objects = RoomQuerySet.as_manager()
+
+    # Fields cached by open chat sockets; Chat.signals tells them when these change
+    SOCKET_CONTEXT_FIELDS = ("name", "is_active")
+
+    class Meta:
+        indexes = [
+            # Group search (core.search.trigram_search)
+            trigram_index("name", "chat_room_name_trgm_idx"),
+            trigram_index("description", "chat_room_description_trgm_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        room = super().from_db(db, field_names, values)
+        room.loaded_context = {
+            field: getattr(room, field) for field in cls.SOCKET_CONTEXT_FIELDS if field in field_names
+        }
+        return room
+
+    def changed_context(self, update_fields=None):
+        """
+        The socket context fields that differ from what was loaded (all that are set
+        when the room was not loaded from the database), as {field: new value}.
+        """
+        loaded = getattr(self, "loaded_context", {})
+        deferred = self.get_deferred_fields()
+        return {
+            field: getattr(self, field)
+            for field in self.SOCKET_CONTEXT_FIELDS
+            if field not in deferred
+            and (update_fields is None or field in update_fields)
+            and (field not in loaded or loaded[field] != getattr(self, field))
+        }
+
 class Message(models.Model):
     MESSAGE_TYPE_CHOICES = [
         ("text", "Text"),
@@ -39,10 +134,10 @@ class Message(models.Model):
     content = models.TextField(blank=True, null=True)  # For text messages
     attachment = CloudinaryField("attachment", blank=True, null=True)  # For files/images
     parent_message = models.ForeignKey(
-        "self", on_delete=models.CASCADE, related_name="replies", blank=True, null=True
+        "self", on_delete=models.CASCADE, related_name="replies", blank=True, null=True, db_constraint=False
     )  # For threaded messages
     mentions = models.ManyToManyField(
-        settings.AUTH_USER_MODEL, related_name="mentioned_in", blank=True
+        settings.AUTH_USER_MODEL, related_name="mentioned_in", blank=True, db_constraint=False
     ) 
     reactions = models.JSONField(blank=True, null=True)  
     is_deleted = models.BooleanField(default=False) 
@@ -52,8 +147,27 @@ class Message(models.Model):
     )
     is_pinned = models.BooleanField(default=False)
     pinned_at = models.DateTimeField(null=True, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    seq = models.PositiveBigIntegerField(null=True, blank=True)  # Position in the room, 1-based
+    # A default rather than auto_now_add, so the write-behind flusher can insert messages
+    # with the time they were sent
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
+    # Computed by PostgreSQL from `content`, so inserts and edits (including bulk ones) keep it current
+    search_vector = models.GeneratedField(
+        expression=SearchVector("content", config=MESSAGE_SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a room's history seeks on (created_at, id)
+            models.Index(fields=["room", "created_at", "id"], name="chat_msg_room_created_id_idx"),
+            models.Index(fields=["room", "seq"], name="chat_msg_room_seq_idx"),
+            # Delta sync (Chat.sync) scans a room's recently changed messages
+            models.Index(fields=["room", "updated_at"], name="chat_msg_room_updated_idx"),
+            GinIndex(fields=["search_vector"], name="chat_msg_search_vector_idx"),
+        ]
 
     def __str__(self):
         return f"Message from {self.sender} in {self.room}"
@@ -77,25 +191,43 @@ class Message(models.Model):
             raise ValidationError("You can only pin up to 3 messages per room.")
         self.is_pinned = True
         self.pinned_at = timezone.now()
-        self.save(update_fields=["is_pinned", "pinned_at"])
+        self.save(update_fields=["is_pinned", "pinned_at", "updated_at"])
 
     def unpin(self):
         self.is_pinned = False
         self.pinned_at = None
-        self.save(update_fields=["is_pinned", "pinned_at"])
+        self.save(update_fields=["is_pinned", "pinned_at", "updated_at"])
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, check_membership=True, **kwargs):
         """
         Override the save method to ensure the sender is a member of the room.
+        Callers that already verified membership pass check_membership=False.
         """
-        if not self.room.members.filter(id=self.sender.id).exists():
+        if check_membership and not self.room.members.filter(id=self.sender_id).exists():
             raise ValueError("The sender must be a member of the room to send a message.")
         super().save(*args, **kwargs)
 
+class MessageReaction(models.Model):
+    """
+    One row per user, message and emoji. Message.reactions holds the aggregated
+    counts and is maintained incrementally by Chat.reactions.
+    """
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name="user_reactions", db_constraint=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="message_reactions")
+    emoji = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('message', 'user', 'emoji')
+
+    def __str__(self):
+        return f"{self.user} reacted {self.emoji} to message {self.message_id}"
+
 class UserRoomStatus(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="room_statuses")
     room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="user_statuses")
     last_read = models.DateTimeField(null=True, blank=True)
+    last_read_seq = models.PositiveBigIntegerField(default=0)  # Room.message_seq when last read
 
     class Meta:
         unique_together = ('user', 'room')
@@ -0,0 +1,135 @@
+"""
+Monthly range partitions of the message table (PostgreSQL declarative partitioning).
+
+Chat_message is partitioned by RANGE (created_at): one partition per calendar month
+(UTC) named Chat_message_pYYYY_MM, plus Chat_message_default, which catches rows
+outside every range so inserts never fail. History queries filter and order on
+(room, created_at), so PostgreSQL prunes them to the newest partitions. Lookups by id
+probe the primary key index, (id, created_at), of each partition.
+
+Upcoming partitions are created after every `migrate` and by
+`manage.py ensure_message_partitions` (run it daily from cron).
+`manage.py archive_message_partitions` detaches old ones.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Message
+
+PARTITIONS_AHEAD = 3
+ARCHIVE_SCHEMA = "chat_archive"
+
+_partition_suffix = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def parent_table():
+    return Message._meta.db_table
+
+
+def default_partition():
+    return f"{parent_table()}_default"
+
+
+def partition_name(month):
+    return f"{parent_table()}_p{month:%Y_%m}"
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+        [connection.ops.quote_name(parent_table())],
+    )
+    return cursor.fetchone()[0]
+
+
+def insertable_columns(cursor, table):
+    """
+    Columns of `table` that accept values (everything but generated columns).
+    """
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER' "
+        "ORDER BY ordinal_position",
+        [table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def list_partitions(cursor):
+    """
+    Return {month start: partition name} of the attached monthly partitions.
+    """
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)",
+        [connection.ops.quote_name(parent_table())],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = _partition_suffix.search(name)
+        if match:
+            month = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+            partitions[month] = name
+    return partitions
+
+
+def create_partition(cursor, month):
+    """
+    Create the partition for `month`. Rows of that month that already landed in the
+    default partition are moved into it, since PostgreSQL refuses to attach a range
+    that the default partition holds rows for.
+    """
+    quote = connection.ops.quote_name
+    parent, default, name = quote(parent_table()), quote(default_partition()), quote(partition_name(month))
+    bounds = [month, add_months(month, 1)]
+
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE created_at >= %s AND created_at < %s)", bounds)
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)", bounds)
+        return
+
+    columns = ", ".join(quote(column) for column in insertable_columns(cursor, parent_table()))
+    cursor.execute(
+        f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)"
+    )
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {default} WHERE created_at >= %s AND created_at < %s RETURNING {columns}) "
+        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved",
+        bounds,
+    )
+    cursor.execute(f"ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", bounds)
+
+
+def ensure_partitions(ahead=PARTITIONS_AHEAD, now=None):
+    """
+    Create the partitions of the current month and the next `ahead` months that do
+    not exist yet. Returns the names of the created partitions.
+    """
+    first = month_start(now or timezone.now())
+    created = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        if not is_partitioned(cursor):
+            return created
+        # Serialize concurrent runs (several web workers migrating, cron overlapping)
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [parent_table()])
+        existing = list_partitions(cursor)
+        for offset in range(ahead + 1):
+            month = add_months(first, offset)
+            if month not in existing:
+                create_partition(cursor, month)
+                created.append(partition_name(month))
+    return created
+
+
+def ensure_partitions_after_migrate(sender, **kwargs):
+    ensure_partitions()
@@ -0,0 +1,93 @@
+"""
+Cluster-wide chat presence backed by Redis.
+
+Every open socket is tracked as a connection of its user:
+
+  presence:user:<user_id>  sorted set, member = connection id, score = expiry time
+  presence:online          sorted set, member = user id, score = expiry of the user's newest connection
+
+A user stays online while at least one of their connections is alive, i.e. it has been
+heartbeated within PRESENCE_TTL seconds. Connections that die without a disconnect
+(crashed worker, lost network) simply expire. All updates run as Lua scripts so
+concurrent connects/disconnects from different workers never lose updates.
+"""
+import time
+from django.conf import settings
+from core.redis_client import get_async_redis
+
+ONLINE_KEY = "presence:online"
+
+# KEYS[1] = connections of the user, KEYS[2] = online users
+# ARGV[1] = connection id, ARGV[2] = user id, ARGV[3] = now, ARGV[4] = ttl
+TOUCH_SCRIPT = """
+local expires = tonumber(ARGV[3]) + tonumber(ARGV[4])
+redis.call('ZADD', KEYS[1], expires, ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('ZADD', KEYS[2], 'GT', expires, ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[3])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+DISCONNECT_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[3])
+local remaining = redis.call('ZCARD', KEYS[1])
+if remaining == 0 then
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[2], ARGV[2])
+else
+    local newest = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    redis.call('ZADD', KEYS[2], newest[2], ARGV[2])
+end
+return remaining
+"""
+
+
+def connections_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+def _script_args(user_id, connection_id):
+    keys = [connections_key(user_id), ONLINE_KEY]
+    args = [connection_id, user_id, time.time(), settings.PRESENCE_TTL]
+    return keys, args
+
+
+async def connect(user_id, connection_id):
+    """
+    Register a new connection for the user. Returns the user's number of live connections.
+    """
+    keys, args = _script_args(user_id, connection_id)
+    return await get_async_redis().eval(TOUCH_SCRIPT, len(keys), *keys, *args)
+
+
+# A heartbeat is a connect for an already registered connection.
+heartbeat = connect
+
+
+async def disconnect(user_id, connection_id):
+    """
+    Drop a connection of the user. Returns the user's number of remaining live connections.
+    """
+    keys, args = _script_args(user_id, connection_id)
+    return await get_async_redis().eval(DISCONNECT_SCRIPT, len(keys), *keys, *args)
+
+
+def _online_from_scores(user_ids, scores):
+    now = time.time()
+    return {
+        user_id for user_id, score in zip(user_ids, scores)
+        if score is not None and score > now
+    }
+
+
+async def online_user_ids(user_ids):
+    """
+    Return the subset of user_ids that are currently online, in a single round-trip.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+    scores = await get_async_redis().zmscore(ONLINE_KEY, user_ids)
+    return _online_from_scores(user_ids, scores)
@@ -0,0 +1,138 @@
+"""
+Message reactions: one MessageReaction row per (message, user, emoji).
+
+Message.reactions keeps the aggregated {emoji: count} map. It is changed with a single
+atomic jsonb UPDATE per reaction, so concurrent reactions never lose updates and the
+row is never rewritten through Message.save().
+
+The counts of hot messages are also cached in Redis (reactions:<message_id> hashes), so
+the count broadcast with a reaction is served without reading the message back. The
+cache is only written inside the reaction transaction, while the UPDATE holds the
+message's row lock: reactions to a message update it one at a time, in commit order,
+and a miss is seeded from the counts read under that same lock, so concurrent
+reactions can neither double count nor overwrite a newer count with an older one.
+"""
+import logging
+from django.db import IntegrityError, transaction
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from redis.exceptions import RedisError
+from core.redis_client import get_redis
+from .models import Message, MessageReaction
+
+logger = logging.getLogger(__name__)
+
+CACHE_TTL = 60 * 60
+
+# Returns the new count, or nil when the hash is not cached (the caller seeds it)
+INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if count <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    count = 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return count
+"""
+
+
+def cache_key(message_id):
+    return f"reactions:{message_id}"
+
+
+def is_valid_emoji(emoji):
+    return isinstance(emoji, str) and 0 < len(emoji) <= MessageReaction._meta.get_field("emoji").max_length
+
+
+def count_delta(emoji, delta):
+    """
+    jsonb expression adding `delta` to reactions[emoji], dropping the key at zero.
+    """
+    return RawSQL(
+        "CASE WHEN COALESCE((reactions ->> %s::text)::int, 0) + %s > 0 "
+        "THEN jsonb_set(COALESCE(reactions, '{}'::jsonb), ARRAY[%s::text], "
+        "to_jsonb(COALESCE((reactions ->> %s::text)::int, 0) + %s)) "
+        "ELSE COALESCE(reactions, '{}'::jsonb) - %s::text END",
+        (emoji, delta, emoji, emoji, delta, emoji),
+    )
+
+
+def set_reaction(message_id, room_id, user, emoji, add=True):
+    """
+    Add (or remove) `user`'s `emoji` reaction on a message of `room_id`.
+
+    :return: None if the message does not exist in the room, otherwise (delta, count):
+             the change in the emoji's count (+1/-1, or 0 if the user had (not) reacted
+             already) and its new count (None when unchanged).
+    """
+    try:
+        with transaction.atomic():
+            if not Message.objects.filter(pk=message_id, room_id=room_id).exists():
+                return None
+
+            if add:
+                try:
+                    with transaction.atomic():
+                        MessageReaction.objects.create(message_id=message_id, user=user, emoji=emoji)
+                    delta = 1
+                except IntegrityError:
+                    delta = 0  # Already reacted with this emoji
+            else:
+                delta = -MessageReaction.objects.filter(message_id=message_id, user=user, emoji=emoji).delete()[0]
+
+            if not delta:
+                return 0, None
+            Message.objects.filter(pk=message_id).update(
+                reactions=count_delta(emoji, delta),
+                updated_at=timezone.now(),
+            )
+            # Concurrent reactions wait on the row lock taken by the UPDATE until we commit
+            count = update_cache(message_id, emoji, delta)
+    except Exception:
+        # The cache may already hold this reaction's count; it must not outlive a rollback
+        forget_cache(cache_key(message_id))
+        raise
+    return delta, count
+
+
+def update_cache(message_id, emoji, delta):
+    """
+    Apply a reaction delta to the cached counts and return the emoji's new count. Must
+    run inside the reaction transaction, after the UPDATE of the message's counts.
+    """
+    key = cache_key(message_id)
+    try:
+        count = get_redis().eval(INCREMENT_SCRIPT, 1, key, emoji, delta, CACHE_TTL)
+        if count is not None:
+            return int(count)
+    except RedisError:
+        logger.exception("Updating the cached reactions of message %s failed", message_id)
+        forget_cache(key)
+        return load_counts(message_id).get(emoji, 0)
+
+    counts = load_counts(message_id)
+    if counts:
+        try:
+            with get_redis().pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=counts)
+                pipe.expire(key, CACHE_TTL)
+                pipe.execute()
+        except RedisError:
+            logger.exception("Caching the reactions of message %s failed", message_id)
+    return counts.get(emoji, 0)
+
+
+def forget_cache(key):
+    # A hash that missed an increment would serve a wrong count until it expires
+    try:
+        get_redis().delete(key)
+    except RedisError:
+        logger.exception("Dropping the cached reactions %s failed", key)
+
+
+def load_counts(message_id):
+    return Message.objects.filter(pk=message_id).values_list("reactions", flat=True).first() or {}
+
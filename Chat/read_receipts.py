@@ -0,0 +1,122 @@
+"""
+Read receipts as per-user room watermarks.
+
+A user's read state in a room is a single number, UserRoomStatus.last_read_seq: every
+message with seq <= watermark has been read. Receipts therefore cost one row per member
+instead of one entry per message and member, and "seen by N" for a page of messages is a
+single aggregate over the room's status rows.
+
+Clients report the newest message they have on screen. ReadReceiptThrottle keeps only the
+highest one per connection and publishes it once per READ_RECEIPT_WINDOW, so scrolling
+through a room moves the watermark once instead of once per message.
+"""
+import asyncio
+import logging
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import Message, UserRoomStatus
+
+logger = logging.getLogger(__name__)
+
+READ_RECEIPT_WINDOW = 1.0
+
+
+def advance_watermark(user_id, room_id, message_id):
+    """
+    Move the user's watermark in the room up to `message_id`. Watermarks never move
+    backwards, so late or duplicated receipts are ignored.
+
+    :return: The new watermark (the message's seq), or None if it did not move.
+    """
+    seq = Message.objects.filter(id=message_id, room_id=room_id).values_list("seq", flat=True).first()
+    if not seq:
+        return None
+
+    now = timezone.now()
+    updated = UserRoomStatus.objects.filter(
+        user_id=user_id, room_id=room_id, last_read_seq__lt=seq
+    ).update(last_read_seq=seq, last_read=now)
+    if not updated:
+        _, created = UserRoomStatus.objects.get_or_create(
+            user_id=user_id, room_id=room_id, defaults={"last_read_seq": seq, "last_read": now}
+        )
+        if not created:
+            return None
+    return seq
+
+
+def seen_by_counts(room_id, messages):
+    """
+    Return {message id: number of room members other than the sender who have read it}
+    for `messages`, computed with one aggregate query over the room's watermarks.
+    """
+    messages = [message for message in messages if message.seq]
+    if not messages:
+        return {}
+
+    counts = UserRoomStatus.objects.filter(room_id=room_id, user__rooms=room_id).aggregate(**{
+        f"seen_{message.id}": Count(
+            "pk", filter=Q(last_read_seq__gte=message.seq) & ~Q(user_id=message.sender_id)
+        )
+        for message in messages
+    })
+    return {message.id: counts[f"seen_{message.id}"] for message in messages}
+
+
+class ReadReceiptThrottle:
+    """
+    Per-connection throttle for read receipts. `publish` is an async callable taking
+    the highest message id reported during the window.
+    """
+
+    def __init__(self, publish, window=READ_RECEIPT_WINDOW):
+        self.publish = publish
+        self.window = window
+        self.highest = 0
+        self.pending = None
+        self.task = None
+
+    def update(self, message_id):
+        """
+        Record that the client has read up to `message_id`. Never awaits.
+        """
+        if message_id <= self.highest:
+            return
+        self.highest = message_id
+        self.pending = message_id
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self.task = None
+        await self.flush()
+
+    async def flush(self):
+        message_id, self.pending = self.pending, None
+        if message_id is None:
+            return
+        try:
+            await self.publish(message_id)
+        except Exception:
+            logger.exception("Publishing read receipt for message %s failed", message_id)
+
+    def discard(self):
+        """
+        Drop the pending receipt without publishing it.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.pending = None
+
+    async def close(self):
+        """
+        Publish the pending receipt right away, e.g. when the socket disconnects.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
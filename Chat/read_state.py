@@ -0,0 +1,151 @@
+"""
+Debounced read-state writes.
+
+Mark-as-read calls only record the new read positions in Redis:
+
+  read_state:pending  hash, field = "<user_id>:<room_id>", value = "<seq>:<unix time>"
+
+Positions only move forward, so however often a client marks a hot room as read, the
+hash holds one entry per user and room. The Chat.tasks.flush_read_positions Celery
+task (scheduled by CELERY_BEAT_SCHEDULE, so a worker must run with --beat) periodically
+takes the whole hash and persists it with a single INSERT ... ON CONFLICT upsert into
+UserRoomStatus; `manage.py flush_read_positions` does the same by hand. Until then,
+unread counts served from the database lag by at most one flush interval, and without
+a flusher read positions never reach the database. If Redis is unavailable the upsert
+runs right away instead.
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+from django.db import DataError, IntegrityError, connection, transaction
+from django.utils import timezone
+from redis.exceptions import RedisError
+from core.redis_client import get_redis
+from .models import Room, UserRoomStatus
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "read_state:pending"
+# Holds the positions taken by a flusher until they are committed
+FLUSHING_KEY = "read_state:flushing"
+UPSERT_BATCH_SIZE = 1000
+
+# KEYS[1] = pending hash; ARGV = field, seq, timestamp, field, seq, timestamp, ...
+RECORD_SCRIPT = """
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(string.match(current, '^%d+')) < tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1] .. ':' .. ARGV[i + 2])
+    end
+end
+return 1
+"""
+
+# KEYS[1] = pending hash, KEYS[2] = flushing hash. Positions left in the flushing hash
+# by a flusher that died are returned again before new ones are taken.
+TAKE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 and redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+end
+return redis.call('HGETALL', KEYS[2])
+"""
+
+
+def mark_rooms_read(user, rooms):
+    """
+    Move the user's read position in each room of `rooms` ({room id: seq or None}) to
+    that seq, or to the latest message when None. Seqs are clamped to the range of the
+    room's messages. Rooms the user is not an active member of are skipped.
+
+    :return: {room id: recorded seq}
+    """
+    current = dict(
+        Room.objects.filter(id__in=rooms.keys(), members=user, is_active=True).values_list("id", "message_seq")
+    )
+    positions = {
+        room_id: message_seq if rooms[room_id] is None else max(0, min(rooms[room_id], message_seq))
+        for room_id, message_seq in current.items()
+    }
+    if not positions:
+        return positions
+
+    now = timezone.now()
+    try:
+        args = []
+        for room_id, seq in positions.items():
+            args += [f"{user.id}:{room_id}", seq, now.timestamp()]
+        get_redis().eval(RECORD_SCRIPT, 1, PENDING_KEY, *args)
+    except RedisError:
+        logger.exception("Recording read positions in Redis failed, writing them directly")
+        persist_read_positions([(user.id, room_id, seq, now) for room_id, seq in positions.items()])
+    return positions
+
+
+def persist_read_positions(positions):
+    """
+    Upsert [(user id, room id, seq, read at), ...] into UserRoomStatus in one statement.
+    Existing positions are never moved backwards.
+    """
+    if not positions:
+        return
+    quote = connection.ops.quote_name
+    table = quote(UserRoomStatus._meta.db_table)
+    values = ", ".join(["(%s, %s, %s, %s)"] * len(positions))
+    params = [value for position in positions for value in position]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (user_id, room_id, last_read_seq, last_read) VALUES {values} "
+            f"ON CONFLICT (user_id, room_id) DO UPDATE SET "
+            f"last_read_seq = GREATEST({table}.last_read_seq, EXCLUDED.last_read_seq), "
+            f"last_read = GREATEST({table}.last_read, EXCLUDED.last_read)",
+            params,
+        )
+
+
+def flush_pending():
+    """
+    Persist the positions recorded in Redis since the last flush. Returns how many.
+    """
+    client = get_redis()
+    flat = client.eval(TAKE_SCRIPT, 2, PENDING_KEY, FLUSHING_KEY)
+    positions = []
+    for field, value in zip(flat[::2], flat[1::2]):
+        try:
+            user_id, room_id = field.split(":")
+            seq, read_at = value.split(":")
+            position = (
+                int(user_id), int(room_id), int(seq), datetime.fromtimestamp(float(read_at), tz=dt_timezone.utc)
+            )
+        except ValueError:
+            logger.warning("Skipping malformed read position %s = %s", field, value)
+            continue
+        if position[2] < 0:
+            logger.warning("Skipping negative read position %s = %s", field, value)
+            continue
+        positions.append(position)
+
+    # Each batch commits on its own, so deferred foreign key checks fail inside
+    # persist_batch; a crash in between only replays idempotent upserts
+    for start in range(0, len(positions), UPSERT_BATCH_SIZE):
+        persist_batch(positions[start:start + UPSERT_BATCH_SIZE])
+    client.delete(FLUSHING_KEY)
+    return len(positions)
+
+
+def persist_batch(positions):
+    """
+    Upsert a batch of positions. If a row cannot be stored (e.g. its room was deleted
+    since it was recorded), the rows are retried one by one and the failing ones are
+    logged and dropped, so they cannot hold up the others.
+    """
+    try:
+        with transaction.atomic():
+            persist_read_positions(positions)
+        return
+    except (DataError, IntegrityError):
+        pass
+    for position in positions:
+        try:
+            with transaction.atomic():
+                persist_read_positions([position])
+        except (DataError, IntegrityError):
+            logger.warning("Dropping read position %s that cannot be stored", position, exc_info=True)
@@ -1,6 +1,7 @@
 from django.urls import path
-from .consumers import ChatConsumer
+from .consumers import ChatConsumer, ChatMultiplexConsumer
 
 websocket_urlpatterns = [
+    path('ws/chat/', ChatMultiplexConsumer.as_asgi()),
     path('ws/chat/<int:room_id>/', ChatConsumer.as_asgi()),
 ]
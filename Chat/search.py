@@ -0,0 +1,22 @@
+"""
+Full-text search over chat messages.
+
+Message.search_vector is a stored tsvector generated from `content` and indexed with
+GIN (chat_msg_search_vector_idx), so matching never scans the message table.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from .models import MESSAGE_SEARCH_CONFIG
+
+
+def search_messages(queryset, text):
+    """
+    Filter `queryset` down to the non-deleted messages matching `text` and annotate
+    each with its `rank`. `text` uses web search syntax: "quoted phrases", `or`, -exclude.
+    """
+    query = SearchQuery(text, config=MESSAGE_SEARCH_CONFIG, search_type="websearch")
+    return queryset.filter(search_vector=query, is_deleted=False).annotate(
+        # ts_rank() is a real; as double precision it round-trips exactly through cursors
+        rank=Cast(SearchRank(F("search_vector"), query), FloatField())
+    )
@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import Room, Message
+from .uploads import local_attachment_url
+from .utils import create_room_message
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
@@ -49,16 +51,31 @@ class UserSerializer(serializers.ModelSerializer):
             return "offline"
 
 
+class AttachmentField(serializers.ImageField):
+    """
+    Message.attachment as a URL, including attachments of the local upload backend
+    (see Chat.uploads).
+    """
+
+    def to_representation(self, value):
+        url = local_attachment_url(value)
+        if url is None:
+            return super().to_representation(value)
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request is not None else url
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
-    attachment = serializers.ImageField(use_url=True)
+    attachment = AttachmentField(use_url=True)
     is_self = serializers.SerializerMethodField()
     parent_message = ParentMessageSerializer(read_only=True)
+    seen_by = serializers.SerializerMethodField()
     
 
     class Meta:
         model = Message
-        fields = '__all__' 
+        exclude = ['search_vector']
 
     def get_is_self(self, obj):
         request = self.context.get("request")
@@ -66,6 +83,13 @@ class MessageSerializer(serializers.ModelSerializer):
             return obj.sender.id == request.user.id
         return False
 
+    def get_seen_by(self, obj):
+        # Computed for the whole page by the view (Chat.read_receipts.seen_by_counts)
+        return self.context.get("seen_by", {}).get(obj.id)
+
+class MessageSearchResultSerializer(MessageSerializer):
+    rank = serializers.FloatField(read_only=True)
+
 class UserForRoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -110,11 +134,20 @@ class RoomSerializer(serializers.ModelSerializer):
         room.members.set(members)  # Add members to the room
         return room
     
+    # Rooms coming from Room.objects.inbox_for() carry their inbox data as annotations
+    # (and the view attaches `inbox_last_message`), so no per-room queries are needed.
+
     def get_last_message(self, obj):
-        last_message = obj.messages.order_by('-created_at').first()
+        if hasattr(obj, "inbox_last_message"):
+            last_message = obj.inbox_last_message
+        else:
+            last_message = obj.messages.order_by('-created_at').first()
         return LastMessageSerializer(last_message).data if last_message else None
     
     def get_unread_count(self, obj):
+        if hasattr(obj, "inbox_unread_count"):
+            return obj.inbox_unread_count
+
         # Retrieve the current user from the serializer
         request = self.context.get("request")
         if not request or not request.user.is_authenticated:
@@ -123,20 +156,17 @@ class RoomSerializer(serializers.ModelSerializer):
         user = request.user
 
         try:
-            status = obj.user_statuses.get(user=user)
-            last_read = status.last_read
-        except Exception:
-            last_read = None
-
-        # If a last_read timestamp exists, count messages created after it
-        if last_read:
-            unread_count = obj.messages.filter(created_at__gt=last_read).exclude(sender=request.user).count()
-        else:
-            unread_count = obj.messages.count()
+            last_read_seq = obj.user_statuses.get(user=user).last_read_seq
+        except obj.user_statuses.model.DoesNotExist:
+            last_read_seq = 0
 
-        return unread_count
+        # Everything posted after the user's read position is unread
+        return max(obj.message_seq - last_read_seq, 0)
     
     def get_last_read_timestamp(self, obj):
+        if hasattr(obj, "inbox_last_read"):
+            return obj.inbox_last_read
+
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             try:
@@ -147,16 +177,15 @@ class RoomSerializer(serializers.ModelSerializer):
         return None
     
     def get_last_read_message_id(self, obj):
+        if hasattr(obj, "inbox_last_read_message_id"):
+            return obj.inbox_last_read_message_id
+
         request = self.context.get("request")
         if request and request.user.is_authenticated:
             try:
                 user_room_status = obj.user_statuses.get(user=request.user)
-                last_read_timestamp = user_room_status.last_read
-                if last_read_timestamp:
-                    # Retrieve the latest message with created_at <= last_read timestamp
-                    last_read_message = obj.messages.filter(
-                        created_at__lte=last_read_timestamp
-                    ).order_by('-created_at').first()
+                if user_room_status.last_read_seq:
+                    last_read_message = obj.messages.filter(seq=user_room_status.last_read_seq).first()
                     if last_read_message:
                         return last_read_message.id
             except obj.user_statuses.model.DoesNotExist:
@@ -208,4 +237,19 @@ class MessageUploadSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         # we’ll set room & sender in the view
-        return Message.objects.create(**validated_data)
+        room = validated_data.pop("room")
+        sender = validated_data.pop("sender")
+        return create_room_message(room, sender, **validated_data)
+
+
+class MessageUploadFinalizeSerializer(serializers.Serializer):
+    upload_token   = serializers.CharField()
+    content        = serializers.CharField(required=False, allow_blank=True)
+    parent_message = serializers.PrimaryKeyRelatedField(queryset=Message.objects.all(), required=False, allow_null=True)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        room = self.context.get("room")
+        if room is not None:
+            # Replies can only point at messages of the same room
+            self.fields["parent_message"].queryset = room.messages.all()
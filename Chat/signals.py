@@ -0,0 +1,56 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import Room
+
+logger = logging.getLogger(__name__)
+
+
+def broadcast_room_update(room_id, **changes):
+    """
+    Tell every socket of the room to refresh its cached room context, once the
+    current transaction has committed. The change itself is already saved, so a
+    channel layer failure is only logged.
+    """
+    def send():
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                f"chat_{room_id}",
+                {"type": "chat_room_updated", "room_id": room_id, **changes},
+            )
+        except Exception:
+            logger.exception("Broadcasting the update of room %s failed", room_id)
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Room)
+def room_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        return
+    changes = instance.changed_context(update_fields)
+    if changes:
+        broadcast_room_update(instance.id, **changes)
+        instance.loaded_context = {**getattr(instance, "loaded_context", {}), **changes}
+
+
+@receiver(post_delete, sender=Room)
+def room_deleted(sender, instance, **kwargs):
+    broadcast_room_update(instance.id, is_active=False)
+
+
+@receiver(m2m_changed, sender=Room.members.through)
+def room_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_remove", "pre_clear"):
+        return
+
+    if reverse:
+        # user.rooms.remove(...) / clear(): instance is the user, pk_set the rooms
+        room_ids = pk_set if action == "post_remove" else instance.rooms.values_list("id", flat=True)
+        for room_id in room_ids:
+            broadcast_room_update(room_id, removed_user_ids=[instance.id])
+    else:
+        user_ids = pk_set if action == "post_remove" else instance.members.values_list("id", flat=True)
+        broadcast_room_update(instance.id, removed_user_ids=list(user_ids))
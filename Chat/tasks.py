@@ -0,0 +1,11 @@
+from celery import shared_task
+from . import read_state
+
+
+@shared_task
+def flush_read_positions():
+    """
+    Persist the read positions recorded in Redis (see Chat.read_state). Scheduled
+    every READ_STATE_FLUSH_INTERVAL seconds by CELERY_BEAT_SCHEDULE.
+    """
+    return read_state.flush_pending()
@@ -1,3 +1,833 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+from contextlib import ExitStack
+from datetime import datetime, timezone as dt_timezone
+from importlib import import_module
+from pathlib import Path
+from unittest import mock
+import msgpack
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.apps import apps as django_apps
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import ProgrammingError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from redis.exceptions import RedisError
+from core.websocket import MAX_INFLATED_FRAME, MSGPACK_DEFLATE, Deflater, Inflater, pack_frame
+from . import flow_control, partitions, reactions, read_state, tasks, uploads, write_behind
+from .consumers import ChatConsumer, ChatMultiplexConsumer
+from .management.commands.flush_chat_messages import Command as FlushChatMessagesCommand
+from .models import Message, MessageReaction, Room, UserRoomStatus
+from .serializers import MessageSerializer
+from .views import MessageCursorPagination
+from .utils import create_room_message
 
-# Create your tests here.
+User = get_user_model()
+
+
+def make_user(name):
+    return User.objects.create_user(
+        email=f"{name}@akgec.ac.in", first_name=name.title(), role="member", year="2nd"
+    )
+
+
+def make_room(name, *members):
+    room = Room.objects.create(name=name, created_by=members[0])
+    room.members.add(*members)
+    return room
+
+
+def make_chat_data(target):
+    target.alice = make_user("alice")
+    target.bob = make_user("bob")
+    target.carol = make_user("carol")
+    target.room = make_room("general", target.alice, target.bob)
+    target.other_room = make_room("private", target.carol)
+
+
+class ChatTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        make_chat_data(cls)
+
+
+class SocketTestCase(TransactionTestCase):
+    """
+    Run ChatConsumer in-process with presence and the per-user rate limits (both
+    Redis-backed) stubbed out. A TransactionTestCase, as database_sync_to_async closes
+    connections left in a transaction.
+    """
+
+    def setUp(self):
+        super().setUp()
+        make_chat_data(self)
+        stack = ExitStack()
+        for name in ("connect", "disconnect", "heartbeat"):
+            stack.enter_context(mock.patch(f"Chat.consumers.presence.{name}", mock.AsyncMock()))
+        stack.enter_context(
+            mock.patch("Chat.consumers.ActionLimiter.check", mock.AsyncMock(return_value=0))
+        )
+        self.addCleanup(stack.close)
+
+    async def open_socket(self, user, room=None, subprotocols=None):
+        if room is None:
+            communicator = WebsocketCommunicator(ChatMultiplexConsumer.as_asgi(), "/ws/chat/")
+        else:
+            communicator = WebsocketCommunicator(
+                ChatConsumer.as_asgi(), f"/ws/chat/{room.id}/", subprotocols=subprotocols
+            )
+            communicator.scope["url_route"] = {"kwargs": {"room_id": room.id}}
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+
+class RedisMockMixin:
+    def mock_redis(self, module):
+        client = mock.MagicMock()
+        patcher = mock.patch(f"{module}.get_redis", return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return client
+
+
+class ReactionTests(RedisMockMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.message = create_room_message(self.room, self.alice, message_type="text", content="hi")
+        self.redis = self.mock_redis("Chat.reactions")
+        self.redis.eval.return_value = None  # Not cached
+
+    def react(self, user, emoji, add=True, room=None):
+        return reactions.set_reaction(self.message.id, (room or self.room).id, user, emoji, add)
+
+    def test_counts_are_aggregated_per_user(self):
+        self.assertEqual(self.react(self.alice, "👍"), (1, 1))
+        self.assertEqual(self.react(self.bob, "👍"), (1, 2))
+        self.assertEqual(self.react(self.bob, "👍"), (0, None))
+        self.assertEqual(self.react(self.bob, "👍", add=False), (-1, 1))
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.reactions, {"👍": 1})
+        self.assertEqual(MessageReaction.objects.filter(message_id=self.message.id).count(), 1)
+
+    def test_message_of_another_room_is_not_found(self):
+        self.assertIsNone(self.react(self.carol, "👍", room=self.other_room))
+
+    def test_cache_miss_is_seeded_with_the_committed_counts(self):
+        self.react(self.alice, "👍")
+        pipe = self.redis.pipeline.return_value.__enter__.return_value
+        pipe.hset.assert_called_with(reactions.cache_key(self.message.id), mapping={"👍": 1})
+
+    def test_cached_count_is_served_from_redis(self):
+        self.redis.eval.return_value = 7
+        self.assertEqual(self.react(self.alice, "👍"), (1, 7))
+
+    def test_redis_failure_falls_back_to_the_database_and_drops_the_cache(self):
+        self.redis.eval.side_effect = RedisError
+        with self.assertLogs("Chat.reactions", "ERROR"):
+            self.assertEqual(self.react(self.alice, "🎉"), (1, 1))
+        self.redis.delete.assert_called_with(reactions.cache_key(self.message.id))
+
+    def test_invalid_emoji(self):
+        self.assertTrue(reactions.is_valid_emoji("👍"))
+        for emoji in ("", "x" * 33, {"a": 1}, ["👍"], 1):
+            self.assertFalse(reactions.is_valid_emoji(emoji), emoji)
+
+
+class ReactionSocketTests(RedisMockMixin, SocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.message = create_room_message(self.room, self.alice, message_type="text", content="hi")
+        self.mock_redis("Chat.reactions").eval.return_value = None
+
+    def test_socket_rejects_invalid_reaction_and_stays_open(self):
+        async def scenario():
+            communicator = await self.open_socket(self.bob, self.room)
+            for reaction in ("x" * 33, {"a": 1}):
+                await communicator.send_json_to(
+                    {"action": "react_message", "message_id": self.message.id, "reaction": reaction}
+                )
+                response = await communicator.receive_json_from()
+                self.assertIn("error", response)
+            # Still usable afterwards
+            await communicator.send_json_to(
+                {"action": "react_message", "message_id": self.message.id, "reaction": "👍"}
+            )
+            event = await communicator.receive_json_from()
+            self.assertEqual((event["reaction"], event["delta"], event["count"]), ("👍", 1, 1))
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertFalse(MessageReaction.objects.exclude(emoji="👍").exists())
+
+
+class StreamEntryMixin:
+    next_ms = 1_700_000_000_000
+
+    def stream_entry(self, sender=None, **fields):
+        self.next_ms += 1
+        entry = {
+            "id": write_behind.reserve_message_id(),
+            "room_id": self.room.id,
+            "sender_id": (sender or self.alice).id,
+            "message_type": "text",
+            "content": "hello",
+            "attachment": None,
+            "parent_message_id": None,
+            "mentions": [],
+            **fields,
+        }
+        return f"{self.next_ms}-0", {"message": json.dumps(entry)}
+
+    def persist(self, entries):
+        return write_behind.persist_batch([entry for _, entry in write_behind.decode_entries(entries)])
+
+
+class WriteBehindTests(StreamEntryMixin, ChatTestCase):
+    def test_created_at_is_the_stream_time(self):
+        self.assertEqual(
+            write_behind.stream_time("1700000000123-4"),
+            datetime(2023, 11, 14, 22, 13, 20, 123000, tzinfo=dt_timezone.utc),
+        )
+
+    def test_messages_are_inserted_once_with_their_stream_time(self):
+        entries = [self.stream_entry() for _ in range(3)]
+        with CaptureQueriesContext(connection) as queries:
+            count, _ = self.persist(entries)
+        self.assertEqual(count, 3)
+        writes = [
+            query["sql"] for query in queries
+            if query["sql"].startswith(('INSERT INTO "Chat_message"', 'UPDATE "Chat_message"'))
+        ]
+        self.assertEqual(len(writes), 1)
+        messages = Message.objects.filter(room=self.room).order_by("seq")
+        self.assertEqual(
+            [message.created_at for message in messages],
+            [write_behind.stream_time(stream_id) for stream_id, _ in entries],
+        )
+
+    def test_seq_follows_stream_order_across_batches(self):
+        entries = [self.stream_entry() for _ in range(4)]
+        self.persist(entries[:2])
+        self.persist(entries[2:])
+        # Replaying a batch inserts nothing
+        self.assertEqual(self.persist(entries[:2])[0], 0)
+        seqs = Message.objects.filter(room=self.room).order_by("created_at").values_list("seq", flat=True)
+        self.assertEqual(list(seqs), [1, 2, 3, 4])
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.message_seq, 4)
+
+
+class FlusherTests(StreamEntryMixin, TransactionTestCase):
+    """
+    A TransactionTestCase: foreign keys are only checked when the flusher's
+    transaction commits.
+    """
+
+    def setUp(self):
+        super().setUp()
+        make_chat_data(self)
+        self.command = FlushChatMessagesCommand()
+        self.command.client = mock.MagicMock()
+        self.command.stream = "chat:messages"
+        self.command.dead_letter_stream = "chat:messages:dead"
+        self.pipe = self.command.client.pipeline.return_value.__enter__.return_value
+
+    def test_bad_entries_are_dead_lettered_and_the_rest_persisted(self):
+        good = self.stream_entry()
+        too_long = self.stream_entry(message_type="x" * 30)
+        unknown_sender = self.stream_entry(sender=User(id=999_999))
+        garbage = (f"{self.next_ms + 1}-0", {"message": "{not json"})
+
+        with mock.patch.object(self.command, "stderr"):
+            self.assertEqual(self.command.persist([good, too_long, unknown_sender, garbage]), 4)
+
+        self.assertEqual(list(Message.objects.values_list("content", flat=True)), ["hello"])
+        dead = [call.args for call in self.pipe.xadd.call_args_list]
+        self.assertEqual({stream for stream, _ in dead}, {"chat:messages:dead"})
+        self.assertEqual(
+            [fields["stream_id"] for _, fields in dead], [garbage[0], too_long[0], unknown_sender[0]]
+        )
+        self.pipe.xack.assert_called_once_with(
+            "chat:messages", write_behind.CONSUMER_GROUP, good[0], too_long[0], unknown_sender[0], garbage[0]
+        )
+
+    def test_schema_errors_leave_entries_pending(self):
+        with mock.patch("Chat.write_behind.persist_batch", side_effect=ProgrammingError("no such column")):
+            with self.assertRaises(ProgrammingError):
+                self.command.persist([self.stream_entry()])
+        self.command.client.pipeline.assert_not_called()
+
+
+class DeflateSocketTests(RedisMockMixin, SocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.message = create_room_message(self.room, self.alice, message_type="text", content="hi")
+        self.mock_redis("Chat.reactions").eval.return_value = None
+
+    def test_replies_and_broadcasts_share_the_deflate_stream_in_order(self):
+        async def scenario():
+            communicator = await self.open_socket(self.bob, self.room, subprotocols=[MSGPACK_DEFLATE])
+            deflater, inflater = Deflater(), Inflater()
+            frames = [
+                {"action": "no_such_action"},
+                {"action": "react_message", "message_id": self.message.id, "reaction": "👍"},
+                {"action": "no_such_action"},
+                {"action": "react_message", "message_id": self.message.id, "reaction": "🎉"},
+            ]
+            for frame in frames:
+                await communicator.send_to(bytes_data=deflater.compress(pack_frame(frame)))
+            received = [
+                msgpack.unpackb(inflater.decompress(await communicator.receive_from()))
+                for _ in frames
+            ]
+            await communicator.disconnect()
+            return received
+
+        received = async_to_sync(scenario)()
+        self.assertEqual(
+            [frame.get("error") or frame["reaction"] for frame in received],
+            ["Unknown action", "👍", "Unknown action", "🎉"],
+        )
+
+    def test_oversized_frame_closes_the_socket(self):
+        async def scenario():
+            communicator = await self.open_socket(self.bob, self.room, subprotocols=[MSGPACK_DEFLATE])
+            bomb = Deflater().compress(b"\0" * (MAX_INFLATED_FRAME * 4))
+            await communicator.send_to(bytes_data=bomb)
+            output = await communicator.receive_output()
+            await communicator.wait()
+            return output
+
+        self.assertEqual(async_to_sync(scenario)(), {"type": "websocket.close", "code": 1009})
+
+
+class ReplySocketTests(SocketTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("Chat.consumers.deliver_push_notifications", mock.AsyncMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send_reply(self, parent):
+        async def scenario():
+            communicator = await self.open_socket(self.bob, self.room)
+            await communicator.send_json_to({"message": "re", "parent_message_id": parent.id})
+            response = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return response
+
+        return async_to_sync(scenario)()
+
+    def test_reply_embeds_the_parent_from_the_same_room(self):
+        parent = create_room_message(self.room, self.alice, message_type="text", content="question")
+        response = self.send_reply(parent)
+        self.assertEqual(response["parent_message"]["content"], "question")
+        self.assertEqual(Message.objects.get(content="re").parent_message_id, parent.id)
+
+    def test_parent_in_another_room_is_rejected(self):
+        parent = create_room_message(self.other_room, self.carol, message_type="text", content="secret")
+        response = self.send_reply(parent)
+        self.assertEqual(response, {"error": "Parent message does not exist"})
+        self.assertFalse(Message.objects.filter(content="re").exists())
+
+
+class MultiplexSocketTests(SocketTestCase):
+    def setUp(self):
+        super().setUp()
+        self.message = create_room_message(self.room, self.alice, message_type="text", content="hi")
+        patcher = mock.patch.object(ChatMultiplexConsumer, "publish_read_receipt", mock.AsyncMock())
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def leave_after_mark_read(self, leave):
+        async def scenario():
+            communicator = await self.open_socket(self.bob)
+            await communicator.send_json_to(
+                {"action": "mark_read", "room": self.room.id, "message_id": self.message.id}
+            )
+            await leave(communicator)
+            self.assertEqual(
+                await communicator.receive_json_from(), {"action": "unsubscribed", "room": self.room.id}
+            )
+            await communicator.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_unsubscribe_publishes_the_pending_receipt(self):
+        async def unsubscribe(communicator):
+            await communicator.send_json_to({"action": "unsubscribe", "room": self.room.id})
+
+        self.leave_after_mark_read(unsubscribe)
+        self.publish.assert_awaited_once_with(self.room.id, self.message.id)
+
+    def test_removal_discards_the_pending_receipt(self):
+        async def remove(communicator):
+            await get_channel_layer().group_send(
+                f"chat_{self.room.id}",
+                {"type": "chat_room_updated", "room_id": self.room.id, "removed_user_ids": [self.bob.id]},
+            )
+
+        self.leave_after_mark_read(remove)
+        self.publish.assert_not_awaited()
+
+
+class ReadStateTests(RedisMockMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.redis = self.mock_redis("Chat.read_state")
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def last_read_seq(self, room=None):
+        return UserRoomStatus.objects.get(user=self.alice, room=room or self.room).last_read_seq
+
+    def test_positions_never_move_backwards(self):
+        read_at = timezone.now()
+        for seq, expected in ((5, 5), (3, 5), (7, 7)):
+            read_state.persist_read_positions([(self.alice.id, self.room.id, seq, read_at)])
+            self.assertEqual(self.last_read_seq(), expected)
+
+    def test_flush_persists_the_taken_positions_and_skips_bad_ones(self):
+        self.redis.eval.return_value = [
+            f"{self.alice.id}:{self.room.id}", "4:1700000000.5",
+            f"{self.bob.id}:{self.room.id}", "-1:1700000000.5",
+            "garbage", "4:1700000000.5",
+        ]
+        with self.assertLogs("Chat.read_state", "WARNING"):
+            self.assertEqual(tasks.flush_read_positions(), 1)
+        self.assertEqual(self.last_read_seq(), 4)
+        self.assertFalse(UserRoomStatus.objects.filter(user=self.bob).exists())
+        self.redis.delete.assert_called_once_with(read_state.FLUSHING_KEY)
+
+    def test_positions_are_written_directly_when_redis_is_down(self):
+        for _ in range(3):
+            create_room_message(self.room, self.bob, message_type="text", content="hi")
+        self.redis.eval.side_effect = RedisError
+        with self.assertLogs("Chat.read_state", "ERROR"):
+            response = self.client.post(reverse("mark-as-read", args=[self.room.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.last_read_seq(), 3)
+
+    def test_bulk_mark_as_read_validates_positions(self):
+        for rooms in ({str(self.room.id): -1}, {str(self.room.id): "x"}, "all"):
+            response = self.client.post(reverse("bulk-mark-as-read"), {"rooms": rooms}, format="json")
+            self.assertEqual(response.status_code, 400, rooms)
+        self.redis.eval.assert_not_called()
+
+    def test_bulk_mark_as_read_clamps_and_skips_foreign_rooms(self):
+        create_room_message(self.room, self.bob, message_type="text", content="hi")
+        response = self.client.post(
+            reverse("bulk-mark-as-read"),
+            {"rooms": {str(self.room.id): 99, str(self.other_room.id): 1}},
+            format="json",
+        )
+        self.assertEqual(response.json(), {"rooms": {str(self.room.id): 1}})
+
+
+class RoomSignalTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("Chat.signals.get_channel_layer")
+        self.group_send = patcher.start().return_value.group_send = mock.AsyncMock()
+        self.addCleanup(patcher.stop)
+        self.room = Room.objects.get(id=self.room.id)
+
+    def broadcasts(self, change):
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        return [call.args[1] for call in self.group_send.await_args_list]
+
+    def test_saves_that_change_no_socket_context_are_not_broadcast(self):
+        def save():
+            self.room.description = "new"
+            self.room.save()
+            self.room.created_by = self.bob
+            self.room.save(update_fields=["created_by"])
+
+        self.assertEqual(self.broadcasts(save), [])
+
+    def test_rename_is_broadcast_once(self):
+        def rename():
+            self.room.name = "renamed"
+            self.room.save()
+            self.room.save()
+
+        self.assertEqual(
+            self.broadcasts(rename), [{"type": "chat_room_updated", "room_id": self.room.id, "name": "renamed"}]
+        )
+
+    def test_removed_members_are_broadcast(self):
+        self.assertEqual(
+            self.broadcasts(lambda: self.room.members.remove(self.bob)),
+            [{"type": "chat_room_updated", "room_id": self.room.id, "removed_user_ids": [self.bob.id]}],
+        )
+
+    def test_channel_layer_failure_does_not_fail_the_save(self):
+        self.group_send.side_effect = OSError("Redis is down")
+
+        def deactivate():
+            self.room.is_active = False
+            self.room.save()
+
+        with self.assertLogs("Chat.signals", "ERROR"):
+            self.broadcasts(deactivate)
+        self.assertFalse(Room.objects.get(id=self.room.id).is_active)
+
+    def test_backfill_does_not_broadcast(self):
+        for content in ("one", "two"):
+            create_room_message(self.room, self.alice, message_type="text", content=content)
+        Message.objects.filter(room=self.room).update(seq=None)
+
+        self.assertEqual(
+            self.broadcasts(lambda: call_command("backfill_room_activity", room=[self.room.id], stdout=mock.Mock())),
+            [],
+        )
+        self.assertEqual(
+            list(Message.objects.filter(room=self.room).order_by("seq").values_list("content", flat=True)),
+            ["one", "two"],
+        )
+        self.room.refresh_from_db()
+        self.assertEqual((self.room.message_seq, self.room.last_message.content), (2, "two"))
+
+
+class LocalUploadTests(RedisMockMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(CHAT_UPLOAD_BACKEND="local", MEDIA_ROOT=Path(media_root.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.redis = self.mock_redis("Chat.uploads")
+        self.redis.exists.return_value = 0
+        self.redis.set.return_value = True
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def sign(self, **data):
+        return self.client.post(reverse("message-upload-sign", args=[self.room.id]), data, format="json")
+
+    def upload(self, target, content=b"contents"):
+        return APIClient().post(target["url"], {"file": SimpleUploadedFile("notes.txt", content)})
+
+    def test_content_type_must_be_a_string(self):
+        for content_type in (["image/png"], {"a": 1}, 1, ""):
+            self.assertEqual(self.sign(content_type=content_type).status_code, 400, content_type)
+
+    def test_upload_key_takes_a_single_upload(self):
+        target = self.sign(content_type="text/plain").json()["upload"]
+        self.assertEqual(self.upload(target).status_code, 201)
+        response = self.upload(target, b"replaced")
+        self.assertEqual(response.status_code, 400)
+        key = uploads.read_upload_token(target["url"].rstrip("/").rsplit("/", 1)[1])["key"]
+        with uploads.LocalUploadBackend().storage.open(key) as file:
+            self.assertEqual(file.read(), b"contents")
+
+    def test_finalized_key_cannot_be_uploaded_again(self):
+        signed = self.sign(content_type="text/plain").json()
+        self.redis.exists.return_value = 1
+        self.assertEqual(self.upload(signed["upload"]).status_code, 400)
+
+    def test_finalized_attachment_is_served_from_local_storage(self):
+        signed = self.sign(content_type="text/plain").json()
+        self.upload(signed["upload"])
+        with mock.patch("Chat.views.broadcast_attachment_message"):
+            response = self.client.post(
+                reverse("message-upload-finalize", args=[self.room.id]),
+                {"upload_token": signed["upload_token"]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, 201)
+        url = response.json()["attachment"]
+        self.assertTrue(url.startswith("/media/chat_uploads/chat/"), url)
+
+        message = Message.objects.get(id=response.json()["id"])
+        self.assertEqual(message.message_type, "file")
+        self.assertEqual(MessageSerializer(message).data["attachment"], url)
+
+
+class SyncTests(RedisMockMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mock_redis("Chat.reactions").eval.return_value = None
+        self.messages = [
+            create_room_message(self.room, self.bob, message_type="text", content=str(n)) for n in range(1, 6)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def sync(self, **data):
+        response = self.client.post(reverse("chat-sync"), data, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        return body["synced_at"], next(room for room in body["rooms"] if room["room"] == self.room.id)
+
+    def test_new_messages_are_paged_by_seq(self):
+        with mock.patch("Chat.sync.SYNC_ROOM_LIMIT", 2):
+            _, room = self.sync(rooms={self.room.id: 1})
+        self.assertEqual([message["content"] for message in room["messages"]], ["2", "3"])
+        self.assertEqual((room["next_seq"], room["has_more"]), (3, True))
+
+        _, room = self.sync(rooms={self.room.id: 3})
+        self.assertEqual([message["content"] for message in room["messages"]], ["4", "5"])
+        self.assertEqual((room["next_seq"], room["has_more"]), (5, False))
+
+    def test_changes_resume_from_the_cursor(self):
+        synced_at, _ = self.sync(rooms={self.room.id: 5})
+        for message in self.messages[:3]:
+            message.content = "edited"
+            message.save()
+
+        with mock.patch("Chat.sync.SYNC_ROOM_LIMIT", 2):
+            _, room = self.sync(rooms={self.room.id: 5}, since=synced_at)
+            self.assertTrue(room["has_more"])
+            changed = [change["id"] for change in room["changes"]]
+            _, room = self.sync(
+                rooms={self.room.id: 5}, since=synced_at, cursors={self.room.id: room["changes_cursor"]}
+            )
+        changed += [change["id"] for change in room["changes"]]
+        self.assertEqual(changed, [message.id for message in self.messages[:3]])
+        self.assertFalse(room["has_more"])
+
+    def test_reactions_are_synced_as_changes(self):
+        synced_at, _ = self.sync(rooms={self.room.id: 5})
+        reactions.set_reaction(self.messages[0].id, self.room.id, self.alice, "👍", True)
+        _, room = self.sync(rooms={self.room.id: 5}, since=synced_at)
+        self.assertEqual(
+            [(change["id"], change["reactions"]) for change in room["changes"]], [(self.messages[0].id, {"👍": 1})]
+        )
+
+    def test_invalid_cursors_are_rejected(self):
+        for cursors in ({self.room.id: {"updated_at": "yesterday", "id": 1}}, {self.room.id: {"id": 1}}, [1]):
+            response = self.client.post(
+                reverse("chat-sync"), {"rooms": {self.room.id: 5}, "cursors": cursors}, format="json"
+            )
+            self.assertEqual(response.status_code, 400, cursors)
+
+
+class MessageCursorTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.messages = [
+            create_room_message(self.room, self.bob, message_type="text", content=str(n)) for n in range(5)
+        ]
+        # Ties on created_at are broken by id
+        Message.objects.filter(id__in=[m.id for m in self.messages[1:4]]).update(
+            created_at=self.messages[1].created_at
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def page(self, **params):
+        response = self.client.get(reverse("room-messages", args=[self.room.id]), {"page_size": 2, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        return [message["content"] for message in body["results"]], body
+
+    def test_scrolling_back_visits_every_message_once(self):
+        contents, body = self.page(mode="cursor")
+        seen = list(contents)
+        while body["has_more"]:
+            contents, body = self.page(before=body["before"])
+            seen += contents
+        self.assertEqual(seen, ["4", "3", "2", "1", "0"])
+
+    def test_after_cursor_returns_newer_messages(self):
+        after = MessageCursorPagination.encode_cursor(Message.objects.get(id=self.messages[1].id))
+        contents, body = self.page(after=after)
+        self.assertEqual(contents, ["3", "2"])
+        self.assertTrue(body["has_more"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("room-messages", args=[self.room.id]), {"before": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+
+class InboxTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quiet_room = make_room("quiet", self.alice, self.bob)
+        self.messages = [
+            create_room_message(self.room, self.bob, message_type="text", content=str(n)) for n in range(3)
+        ]
+        read_state.persist_read_positions([(self.alice.id, self.room.id, 1, timezone.now())])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def test_rooms_are_annotated_in_one_query(self):
+        rooms = Room.objects.filter(members=self.alice).inbox_for(self.alice)
+        with self.assertNumQueries(1):
+            inbox = {
+                room.id: (room.inbox_unread_count, room.inbox_last_read_message_id, room.inbox_last_message_id)
+                for room in rooms
+            }
+        self.assertEqual(inbox, {
+            self.room.id: (2, self.messages[0].id, self.messages[2].id),
+            self.quiet_room.id: (0, None, None),
+        })
+
+    def test_inbox_lists_rooms_by_latest_activity(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("user-rooms"))
+        # The rooms with their inbox data, then their latest messages (the rest is the
+        # last_seen middleware)
+        self.assertEqual(len([query for query in queries if '"Chat_' in query["sql"]]), 2)
+        self.assertEqual(
+            [(room["id"], room["unread_count"]) for room in response.json()],
+            [(self.room.id, 2), (self.quiet_room.id, 0)],
+        )
+        create_room_message(self.quiet_room, self.bob, message_type="text", content="new")
+        response = self.client.get(reverse("user-rooms"))
+        self.assertEqual(
+            [(room["id"], room["unread_count"]) for room in response.json()],
+            [(self.quiet_room.id, 1), (self.room.id, 2)],
+        )
+
+
+class PartitionTests(ChatTestCase):
+    """
+    The DDL runs inside the test transaction and is rolled back with it.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.messages = [
+            create_room_message(self.room, self.bob, message_type="text", content=str(n)) for n in range(3)
+        ]
+        self.old_month = partitions.add_months(partitions.month_start(timezone.now()), -30)
+        Message.objects.filter(id=self.messages[0].id).update(created_at=self.old_month)
+
+    def table_of(self, message_id):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text FROM "Chat_message" WHERE id = %s', [message_id])
+            return cursor.fetchone()[0].strip('"')
+
+    def test_migration_partitions_an_existing_table(self):
+        partition_migration = import_module("Chat.migrations.0012_partition_messages_by_month")
+        with connection.cursor() as cursor:
+            # Rebuild the table as it was before the migration, with the same rows. The
+            # foreign key checks of setUp's inserts must run before the table is dropped.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute('ALTER TABLE "Chat_message" RENAME TO "Chat_message_old"')
+            cursor.execute('CREATE TABLE "Chat_message" (LIKE "Chat_message_old" INCLUDING GENERATED)')
+            columns = ", ".join(f'"{column}"' for column in partitions.insertable_columns(cursor, "Chat_message"))
+            cursor.execute(f'INSERT INTO "Chat_message" ({columns}) SELECT {columns} FROM "Chat_message_old"')
+            cursor.execute('DROP TABLE "Chat_message_old" CASCADE')
+            self.assertFalse(partitions.is_partitioned(cursor))
+
+        with connection.schema_editor() as schema_editor:
+            partition_migration.partition_message_table(django_apps, schema_editor)
+
+        with connection.cursor() as cursor:
+            self.assertTrue(partitions.is_partitioned(cursor))
+            months = partitions.list_partitions(cursor)
+        self.assertEqual(min(months), self.old_month)
+        self.assertEqual(len(months), 30 + partitions.PARTITIONS_AHEAD + 1)
+        self.assertEqual(self.table_of(self.messages[0].id), partitions.partition_name(self.old_month))
+        self.assertEqual(
+            list(Message.objects.filter(room=self.room).order_by("seq").values_list("content", flat=True)),
+            ["0", "1", "2"],
+        )
+        # Ids continue after the copied rows
+        message = create_room_message(self.room, self.bob, message_type="text", content="new")
+        self.assertGreater(message.id, self.messages[-1].id)
+
+    def test_rows_in_the_default_partition_move_to_a_new_month(self):
+        future = partitions.add_months(partitions.month_start(timezone.now()), 24)
+        Message.objects.filter(id=self.messages[1].id).update(created_at=future)
+        self.assertEqual(self.table_of(self.messages[1].id), partitions.default_partition())
+
+        created = partitions.ensure_partitions(ahead=0, now=future)
+
+        self.assertEqual(created, [partitions.partition_name(future)])
+        self.assertEqual(self.table_of(self.messages[1].id), partitions.partition_name(future))
+        self.assertEqual(partitions.ensure_partitions(ahead=0, now=future), [])
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("Chat.flow_control.time")
+        self.time = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.time.monotonic.return_value = 100.0
+        self.time.time.return_value = 1_700_000_000.0
+
+    def test_burst_then_refill(self):
+        bucket = flow_control.TokenBucket(capacity=2, rate=4.0)
+        self.assertEqual([bucket.take(), bucket.take()], [0, 0])
+        self.assertEqual(bucket.take(), 0.25)
+        self.time.monotonic.return_value += 0.25
+        self.assertEqual(bucket.take(), 0)
+        # Refills never exceed the capacity
+        self.time.monotonic.return_value += 60
+        self.assertEqual([bucket.take(), bucket.take()], [0, 0])
+        self.assertGreater(bucket.take(), 0)
+
+    def test_connection_budget_is_checked_before_redis(self):
+        limiter = flow_control.ActionLimiter(user_id=1)
+        with mock.patch("Chat.flow_control.get_async_redis") as get_async_redis:
+            for _ in range(flow_control.CONNECTION_BUDGETS["typing"][0]):
+                self.assertEqual(async_to_sync(limiter.check)("typing"), 0)
+            self.assertGreater(async_to_sync(limiter.check)("typing"), 0)
+        get_async_redis.assert_not_called()
+        self.assertTrue(limiter.is_silent("typing"))
+
+    def test_user_budget_is_shared_through_redis(self):
+        limiter = flow_control.ActionLimiter(user_id=1)
+        redis = mock.MagicMock()
+        redis.eval = mock.AsyncMock(return_value=[0, "0.5"])
+        with mock.patch("Chat.flow_control.get_async_redis", return_value=redis):
+            self.assertEqual(async_to_sync(limiter.check)("send_message"), 0.5)
+            redis.eval.side_effect = RedisError
+            with self.assertLogs("Chat.flow_control", "ERROR"):
+                self.assertEqual(async_to_sync(limiter.check)("send_message"), 0)
+        self.assertEqual(redis.eval.await_args.args[2], flow_control.bucket_key(1, "message"))
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def test_full_queue_drops_ephemeral_frames_then_overflows(self):
+        async def scenario():
+            on_overflow = mock.AsyncMock()
+            queue = flow_control.OutboundQueue(mock.AsyncMock(), on_overflow, maxsize=2)
+            queue.put("typing", ephemeral=True)
+            queue.put("first")
+            queue.put("typing again", ephemeral=True)  # Full: dropped
+            queue.put("second")  # Evicts the queued typing frame
+            queue.put("third")  # Nothing left to evict
+            queue.put("fourth")  # Ignored once overflowed
+            await asyncio.sleep(0)
+            return queue, on_overflow
+
+        queue, on_overflow = async_to_sync(scenario)()
+        self.assertEqual([args for _, args in queue.frames], [("first",), ("second",)])
+        self.assertEqual(queue.dropped, 3)
+        on_overflow.assert_awaited_once()
+
+
+class RateLimitSocketTests(SocketTestCase):
+    def test_over_budget_action_is_answered_with_retry_after(self):
+        async def scenario():
+            communicator = await self.open_socket(self.bob, self.room)
+            with mock.patch("Chat.consumers.ActionLimiter.check", mock.AsyncMock(return_value=1.234)):
+                await communicator.send_json_to({"message": "hi"})
+                response = await communicator.receive_json_from()
+                await communicator.send_json_to({"action": "typing"})
+                self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return response
+
+        self.assertEqual(
+            async_to_sync(scenario)(),
+            {"error": "Rate limit exceeded.", "action": "send_message", "retry_after": 1.23},
+        )
+        self.assertFalse(Message.objects.exists())
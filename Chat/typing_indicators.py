@@ -0,0 +1,70 @@
+"""
+Per-process coalescing of typing indicators.
+
+Clients send typing/stop_typing on every keystroke burst. Instead of one group_send per
+frame, updates are buffered per room for TYPING_WINDOW seconds and flushed as a single
+chat_typing event carrying the latest state of every user that changed. A user whose
+state did not change is only re-announced every TYPING_REFRESH seconds, to keep the
+indicator alive on the receivers.
+"""
+import asyncio
+from . import events
+from core.websocket import pack_frame
+
+TYPING_WINDOW = 0.5
+TYPING_REFRESH = 3.0
+
+
+class TypingCoalescer:
+    def __init__(self, window=TYPING_WINDOW, refresh=TYPING_REFRESH):
+        self.window = window
+        self.refresh = refresh
+        self.pending = {}    # group -> {user_id: (room_id, sender_details, is_typing)}
+        self.last_sent = {}  # (group, user_id) -> (is_typing, loop time)
+        self.flushes = set()
+
+    def update(self, channel_layer, group, room_id, sender, is_typing):
+        """
+        Record a typing state change. Never awaits, so keystroke bursts cost a dict update.
+        """
+        user_id = sender["id"]
+        now = asyncio.get_running_loop().time()
+        last = self.last_sent.get((group, user_id))
+        pending = self.pending.setdefault(group, {})
+        if user_id not in pending and last and last[0] == is_typing and now - last[1] < self.refresh:
+            return
+
+        if not pending:
+            task = asyncio.ensure_future(self.flush(channel_layer, group))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+        pending[user_id] = (room_id, sender, is_typing)
+
+    def forget(self, group, user_id):
+        self.last_sent.pop((group, user_id), None)
+
+    async def flush(self, channel_layer, group):
+        await asyncio.sleep(self.window)
+        updates = self.pending.pop(group, {})
+        if not updates:
+            return
+
+        now = asyncio.get_running_loop().time()
+        for user_id, (room_id, sender, is_typing) in updates.items():
+            if is_typing:
+                self.last_sent[(group, user_id)] = (is_typing, now)
+            else:
+                self.last_sent.pop((group, user_id), None)
+
+        frames = []
+        for user_id, (room_id, sender, is_typing) in updates.items():
+            payload = {"action": "typing", "room": room_id, "sender": sender, "is_typing": is_typing}
+            frames.append({
+                "sender_id": user_id,
+                "frame": events.encode_frame(payload),
+                "packed": pack_frame(payload),
+            })
+        await channel_layer.group_send(group, {"type": "chat_typing", "updates": frames})
+
+
+coalescer = TypingCoalescer()
@@ -0,0 +1,185 @@
+"""
+Two-phase chat attachment uploads.
+
+1. sign:     the API hands out an upload target signed for one file of one room and user.
+2. upload:   the client sends the file straight to the storage backend.
+3. finalize: the client returns the upload token (plus the backend's proof of upload),
+             and the API creates the Message and broadcasts it.
+
+No file bytes pass through Django, so a large attachment never holds a worker.
+
+Backends are selected with settings.CHAT_UPLOAD_BACKEND:
+
+  cloudinary  signed direct uploads to Cloudinary (production)
+  local       files are written under MEDIA_ROOT by LocalUploadTargetView, a stand-in
+              that lets the flow run offline (development, tests)
+
+Message.attachment is a CloudinaryField whatever the backend, so local attachments are
+stored with LOCAL_ATTACHMENT_PREFIX and resolved with local_attachment_url.
+"""
+import time
+import uuid
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+from core.redis_client import get_redis
+
+UPLOAD_TOKEN_SALT = "chat-upload"
+UPLOAD_TOKEN_MAX_AGE = 60 * 60
+# Marks an upload key as finalized; kept as long as its token is valid
+FINALIZED_KEY = "chat-upload:finalized:{key}"
+LOCAL_ATTACHMENT_PREFIX = "local/"
+
+
+class UploadError(Exception):
+    pass
+
+
+def make_upload_token(room_id, user_id, key, content_type):
+    return signing.dumps(
+        {"room": room_id, "user": user_id, "key": key, "content_type": content_type},
+        salt=UPLOAD_TOKEN_SALT,
+    )
+
+
+def read_upload_token(token, room_id=None, user_id=None):
+    """
+    Decode an upload token, checking its signature, age and (when given) that it was
+    issued for `room_id` and `user_id`. Raises UploadError otherwise.
+    """
+    try:
+        data = signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=UPLOAD_TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise UploadError("Upload token has expired.")
+    except signing.BadSignature:
+        raise UploadError("Invalid upload token.")
+    if (room_id is not None and data["room"] != room_id) or (user_id is not None and data["user"] != user_id):
+        raise UploadError("Upload token was issued for another room or user.")
+    return data
+
+
+def claim_upload(key):
+    """
+    Mark the upload `key` as finalized. Returns False if it already was, so a token
+    cannot create more than one message.
+    """
+    return bool(get_redis().set(FINALIZED_KEY.format(key=key), 1, nx=True, ex=UPLOAD_TOKEN_MAX_AGE))
+
+
+def is_claimed(key):
+    return bool(get_redis().exists(FINALIZED_KEY.format(key=key)))
+
+
+def release_upload(key):
+    """
+    Undo claim_upload when the message could not be created, so the client can retry.
+    """
+    get_redis().delete(FINALIZED_KEY.format(key=key))
+
+
+def cloudinary_resource_type(content_type):
+    if content_type.startswith("image/"):
+        return "image"
+    if content_type.startswith("video/"):
+        return "video"
+    return "raw"
+
+
+class CloudinaryUploadBackend:
+    def signed_target(self, key, token, content_type):
+        import cloudinary
+        import cloudinary.utils
+
+        config = cloudinary.config()
+        params = {"public_id": key, "timestamp": int(time.time())}
+        # The resource type follows the signed content type, never the client's claims
+        resource_type = cloudinary_resource_type(content_type)
+        return {
+            "url": cloudinary.utils.cloudinary_api_url("upload", resource_type=resource_type),
+            "method": "POST",
+            "file_field": "file",
+            "fields": {
+                **params,
+                "api_key": config.api_key,
+                "signature": cloudinary.utils.api_sign_request(params, config.api_secret),
+            },
+        }
+
+    def finalize(self, key, content_type, proof):
+        """
+        Check the signed upload response the client got from Cloudinary. Returns the
+        value to store in Message.attachment, its URL and the message type.
+        """
+        import cloudinary
+        import cloudinary.utils
+
+        version, signature = proof.get("version"), proof.get("signature")
+        if not version or not signature or not cloudinary.utils.verify_api_response_signature(key, version, signature):
+            raise UploadError("The upload could not be verified.")
+
+        # Only the public id and version are covered by the signature; everything else
+        # comes from the upload token
+        resource_type = cloudinary_resource_type(content_type)
+        resource = cloudinary.CloudinaryResource(key, version=version, type="upload", resource_type=resource_type)
+        return resource, resource.url, "image" if resource_type == "image" else "file"
+
+
+class LocalUploadBackend:
+    def __init__(self):
+        self.storage = FileSystemStorage(
+            location=settings.MEDIA_ROOT / "chat_uploads",
+            base_url=f"{settings.MEDIA_URL}chat_uploads/",
+        )
+
+    def signed_target(self, key, token, content_type):
+        return {
+            "url": reverse("chat-local-upload", args=[token]),
+            "method": "POST",
+            "file_field": "file",
+            "fields": {},
+        }
+
+    def store(self, key, file):
+        """
+        Save the uploaded file under `key`. As with a signed Cloudinary upload, a key
+        takes a single upload: it is refused once uploaded to or finalized.
+        """
+        if self.storage.exists(key) or is_claimed(key):
+            raise UploadError("This upload has already been used.")
+        name = self.storage.save(key, file)
+        if name != key:
+            # A concurrent upload of the same key won; the storage picked another name
+            self.storage.delete(name)
+            raise UploadError("This upload has already been used.")
+
+    def finalize(self, key, content_type, proof):
+        if not self.storage.exists(key):
+            raise UploadError("The file has not been uploaded.")
+        message_type = "image" if content_type.startswith("image/") else "file"
+        return f"{LOCAL_ATTACHMENT_PREFIX}{key}", self.storage.url(key), message_type
+
+
+def local_attachment_url(attachment):
+    """
+    URL of a Message.attachment stored by LocalUploadBackend, None for any other. The
+    CloudinaryField loads it as a Cloudinary resource whose public id is the stored value.
+    """
+    name = getattr(attachment, "public_id", attachment)
+    if not isinstance(name, str) or not name.startswith(LOCAL_ATTACHMENT_PREFIX):
+        return None
+    return LocalUploadBackend().storage.url(name[len(LOCAL_ATTACHMENT_PREFIX):])
+
+
+BACKENDS = {
+    "cloudinary": CloudinaryUploadBackend,
+    "local": LocalUploadBackend,
+}
+
+
+def get_backend():
+    return BACKENDS[settings.CHAT_UPLOAD_BACKEND]()
+
+
+def new_upload_key(room_id):
+    return f"chat/{room_id}/{uuid.uuid4().hex}"
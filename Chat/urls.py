@@ -1,6 +1,9 @@
 from django.urls import path
 from .views import (
     MessageUploadView,
+    MessageUploadSignAPIView,
+    MessageUploadFinalizeAPIView,
+    LocalUploadTargetView,
     UserRoomsAPIView,
     RoomMembersAPIView,
     RoomMessagesAPIView,
@@ -13,7 +16,11 @@ from .views import (
     AddYourselfToRoomAPIView,
     UserGroupSearchAPIView,
     UserGroupMembersSearchAPIView,
-    MarkRoomAsReadAPIView
+    MarkRoomAsReadAPIView,
+    BulkMarkRoomsAsReadAPIView,
+    MessageSearchAPIView,
+    RoomMessageSearchAPIView,
+    ChatSyncAPIView,
 )
 
 urlpatterns = [
@@ -25,11 +32,17 @@ urlpatterns = [
     path('delete-group/<int:room_id>/', DeleteRoomAPIView.as_view(), name='delete-room'),
     path('edit-group/<int:room_id>/', EditRoomAPIView.as_view(), name='edit-room'),
     path("groups/<int:room_id>/messages/upload/",MessageUploadView.as_view(),name="message-upload"),
+    path("groups/<int:room_id>/messages/upload/sign/", MessageUploadSignAPIView.as_view(), name="message-upload-sign"),
+    path("groups/<int:room_id>/messages/upload/finalize/", MessageUploadFinalizeAPIView.as_view(), name="message-upload-finalize"),
+    path("uploads/local/<str:token>/", LocalUploadTargetView.as_view(), name="chat-local-upload"),
     path('group/<int:room_id>/remove-yourself/', RemoveYourselfFromRoomAPIView.as_view(), name='remove-yourself-from-room'),
     path('group/<int:room_id>/transfer-ownership/', TransferOwnershipAPIView.as_view(), name='transfer-ownership'),
     path('group/<int:room_id>/add-yourself/', AddYourselfToRoomAPIView.as_view(), name='add-yourself-to-room'),
     path('groups/search/', UserGroupSearchAPIView.as_view(), name='group-search'),
     path('groups/<int:room_id>/search/members/',UserGroupMembersSearchAPIView.as_view(), name='group-search-members'),
     path('groups/<int:room_id>/mark-as-read/',MarkRoomAsReadAPIView.as_view(), name='mark-as-read'),
+    path('groups/mark-as-read/', BulkMarkRoomsAsReadAPIView.as_view(), name='bulk-mark-as-read'),
+    path('messages/search/', MessageSearchAPIView.as_view(), name='message-search'),
+    path('groups/<int:room_id>/messages/search/', RoomMessageSearchAPIView.as_view(), name='room-message-search'),
+    path('sync/', ChatSyncAPIView.as_view(), name='chat-sync'),
 ]
-
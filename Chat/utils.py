@@ -0,0 +1,100 @@
+from django.db import transaction
+from Notification.models import Notification
+from .models import Room, Message, UserRoomStatus
+
+
+def get_parent_message_summary(parent_message):
+    """
+    Build the reply preview embedded in chat_message broadcasts.
+
+    Resolved once by the sender so the per-socket handlers never hit the database.
+    Expects the sender to be loaded already (select_related("sender")).
+    """
+    if parent_message is None:
+        return None
+    sender = parent_message.sender
+    return {
+        "id": parent_message.id,
+        "content": parent_message.content,
+        "sender": {
+            "id": sender.id,
+            "name": sender.first_name,
+            "photo": sender.photo.url if sender.photo else None,
+        },
+        "created_at": parent_message.created_at.isoformat(),
+    }
+
+
+def create_room_message(room, sender, check_membership=True, **fields):
+    """
+    Insert a message into `room` and advance the room's activity counters atomically.
+
+    The room row is locked while the next sequence number is assigned, so concurrent
+    senders get gap-free, strictly increasing `seq` values. The sender's read position
+    moves to their own message: a user has always read the room up to what they wrote.
+
+    :param room: Room instance the message is posted in.
+    :param sender: User sending the message.
+    :param check_membership: Set to False when the caller already verified that the
+                             sender is a member of the room.
+    :param fields: Any other Message fields (message_type, content, attachment, ...).
+    :return: The created Message.
+    """
+    with transaction.atomic():
+        seq = Room.objects.select_for_update().values_list("message_seq", flat=True).get(pk=room.pk) + 1
+        message = Message(room=room, sender=sender, seq=seq, **fields)
+        message.save(check_membership=check_membership)
+
+        Room.objects.filter(pk=room.pk).update(
+            message_seq=seq,
+            last_message=message,
+            last_message_at=message.created_at,
+        )
+        UserRoomStatus.objects.bulk_create(
+            [UserRoomStatus(user=sender, room=room, last_read=message.created_at, last_read_seq=seq)],
+            update_conflicts=True,
+            unique_fields=["user", "room"],
+            update_fields=["last_read", "last_read_seq"],
+        )
+
+    room.message_seq = seq
+    room.last_message = message
+    room.last_message_at = message.created_at
+    return message
+
+
+def record_mentions(message, mentioned_ids, room_name):
+    """
+    Attach the mentioned users that are members of the message's room to `message` and
+    create a notification for each of them except the sender.
+
+    Uses one query to resolve the members and one bulk insert each for the mention
+    rows and the notifications, however many users are mentioned.
+
+    :return: The created Notification objects.
+    """
+    member_ids = list(
+        Room.members.through.objects.filter(
+            room_id=message.room_id, user_id__in=mentioned_ids
+        ).values_list("user_id", flat=True)
+    )
+    if not member_ids:
+        return []
+
+    Mention = Message.mentions.through
+    sender = message.sender
+    with transaction.atomic():
+        Mention.objects.bulk_create(
+            [Mention(message_id=message.id, user_id=user_id) for user_id in member_ids],
+            ignore_conflicts=True,
+        )
+        return Notification.objects.bulk_create([
+            Notification(
+                user_id=user_id,
+                event_type='chat_mention',
+                message=f"You were mentioned in {room_name} chat by {sender.first_name}",
+                is_read=False,
+            )
+            for user_id in member_ids
+            if user_id != sender.id
+        ])
@@ -6,14 +6,25 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from .models import Room, Message, UserRoomStatus
-from .serializers import MessageUploadSerializer, RoomSerializer, MessageSerializer, UserSerializer, EditRoomSerializer, RoomListSerializer
+from .models import Room, Message
+from . import events
+from .utils import create_room_message, get_parent_message_summary
+from . import sync, uploads
+from .read_receipts import seen_by_counts
+from .read_state import mark_rooms_read
+from .search import search_messages
+from core.search import parse_limit, trigram_search
+from .serializers import MessageUploadSerializer, RoomSerializer, MessageSerializer, UserSerializer, EditRoomSerializer, RoomListSerializer, MessageSearchResultSerializer, MessageUploadFinalizeSerializer
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from rest_framework.exceptions import NotFound, PermissionDenied
 from django.db.models import Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from datetime import datetime
+import base64
 
 User = get_user_model()
 
@@ -22,25 +33,63 @@ class MarkRoomAsReadAPIView(APIView):
 
     def post(self, request, room_id):
         try:
-            # print(2+2)
-            room = get_object_or_404(Room, id=room_id)
-            status_obj, created = UserRoomStatus.objects.get_or_create(user=request.user, room=room)
-            status_obj.last_read = timezone.now()
-            status_obj.save()
+            # Recorded in Redis and persisted in batches (see Chat.read_state)
+            if not mark_rooms_read(request.user, {room_id: None}):
+                raise NotFound("Room not found.")
             return Response({"message": "Room marked as read."})
+        except NotFound:
+            raise
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class BulkMarkRoomsAsReadAPIView(APIView):
+    """
+    Mark many rooms as read in one call.
+
+    Body: {"rooms": [<room id>, ...]} to mark rooms read up to their latest message, or
+    {"rooms": {"<room id>": <seq>, ...}} to mark them read up to the given positions.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        rooms = request.data.get("rooms")
+        try:
+            if isinstance(rooms, dict):
+                rooms = {int(room_id): int(seq) for room_id, seq in rooms.items()}
+            elif isinstance(rooms, list):
+                rooms = {int(room_id): None for room_id in rooms}
+            else:
+                raise TypeError
+            if any(seq is not None and seq < 0 for seq in rooms.values()):
+                raise ValueError
+        except (TypeError, ValueError):
+            return Response({"error": "'rooms' must be a list of room ids or a map of room id to seq >= 0."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        positions = mark_rooms_read(request.user, rooms)
+        return Response({"rooms": positions}, status=status.HTTP_200_OK)
+
 # Display the groups or rooms the user has joined
 class UserRoomsAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         try:
-            rooms = request.user.rooms.filter(is_active=True)
-            if not rooms.exists():
+            rooms = list(
+                Room.objects.filter(members=request.user, is_active=True)
+                .select_related("created_by")
+                .inbox_for(request.user)
+            )
+            if not rooms:
                 return Response({"message": "You have not joined any rooms."}, status=status.HTTP_404_NOT_FOUND)
 
+            # Second and last query: the latest message of every room, with its sender
+            last_messages = Message.objects.select_related("sender").in_bulk(
+                [room.inbox_last_message_id for room in rooms if room.inbox_last_message_id]
+            )
+            for room in rooms:
+                room.inbox_last_message = last_messages.get(room.inbox_last_message_id)
+
             serializer = RoomSerializer(rooms, many=True, context={'request': request})
             return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -66,16 +115,221 @@ class MessagePagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
     
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id), newest first.
+
+    Pass ?before=<cursor> to scroll back in history and ?after=<cursor> to fetch newer
+    messages (?mode=cursor fetches the latest page). Pages are seeked through the
+    (room, created_at, id) index, so no COUNT(*) or OFFSET is ever run and messages
+    arriving mid-scroll never shift the pages.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    @staticmethod
+    def encode_cursor(message):
+        raw = f"{message.created_at.isoformat()}|{message.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+
+        if after:
+            created_at, pk = self.decode_cursor(after)
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')
+        else:
+            if before:
+                created_at, pk = self.decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+            queryset = queryset.order_by('-created_at', '-id')
+
+        # Fetch one extra row to know whether another page exists in this direction
+        page = list(queryset[:page_size + 1])
+        self.has_more = len(page) > page_size
+        page = page[:page_size]
+        if after:
+            page.reverse()
+
+        self.before_cursor = None
+        self.after_cursor = after
+        if page:
+            self.after_cursor = self.encode_cursor(page[0])
+            # Older messages always exist behind an after cursor
+            if after or self.has_more:
+                self.before_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'before': self.before_cursor,
+            'after': self.after_cursor,
+            'has_more': self.has_more,
+            'results': data,
+        })
+
+
+class MessageSearchPagination(MessageCursorPagination):
+    """
+    Keyset pagination over (rank, id), best match first. Pass the `next` cursor of a
+    page as ?cursor=<cursor> to fetch the following one.
+    """
+
+    @staticmethod
+    def encode_cursor(message):
+        # repr() round-trips the float exactly, so the seek matches the rank in the database
+        raw = f"{message.rank!r}|{message.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            rank, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return float(rank), int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            rank, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(Q(rank__lt=rank) | Q(rank=rank, id__lt=pk))
+
+        page = list(queryset.order_by('-rank', '-id')[:page_size + 1])
+        self.has_more = len(page) > page_size
+        page = page[:page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if self.has_more else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next_cursor,
+            'has_more': self.has_more,
+            'results': data,
+        })
+
+
 class RoomMessagesAPIView(ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = MessageSerializer
     pagination_class = MessagePagination
 
+    @property
+    def paginator(self):
+        # Cursor mode is opt-in so existing page-number clients keep working
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('mode') == 'cursor' or 'before' in params or 'after' in params:
+                self._paginator = MessageCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
         room = get_object_or_404(Room, id=self.kwargs["room_id"], is_active=True)
         if self.request.user not in room.members.all():
             raise PermissionDenied("You are not a member of this room.")
-        return room.messages.all().order_by("-created_at")
+        # Ordering on created_at lets PostgreSQL read the newest partitions first and stop
+        # at the page limit. select_related also tolerates parents in archived partitions.
+        return (
+            room.messages.select_related("sender", "parent_message__sender")
+            .prefetch_related("mentions")
+            .order_by("-created_at")
+        )
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        # "Seen by" of the whole page comes from one aggregate over the room's read watermarks
+        context = {**self.get_serializer_context(), "seen_by": seen_by_counts(self.kwargs["room_id"], page)}
+        serializer = self.get_serializer(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+
+class ChatSyncAPIView(APIView):
+    """
+    Catch a reconnecting client up on all of its rooms in one request (see Chat.sync).
+
+    Body: {"rooms": {"<room id>": <last known seq>, ...}, "since": "<previous synced_at>",
+           "cursors": {"<room id>": <changes_cursor of the previous sync>, ...}}
+    Rooms missing from "rooms" are returned with their counters only. A room with
+    has_more is synced again from "next_seq" and its "changes_cursor".
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        marks = request.data.get("rooms") or {}
+        since = request.data.get("since")
+        cursors = request.data.get("cursors") or {}
+        try:
+            marks = {int(room_id): int(seq) for room_id, seq in marks.items()}
+            since = parse_datetime(since) if since else None
+            cursors = {
+                int(room_id): (parse_datetime(cursor["updated_at"]), int(cursor["id"]))
+                for room_id, cursor in cursors.items()
+            }
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return Response({"error": "Invalid 'rooms', 'since' or 'cursors'."}, status=status.HTTP_400_BAD_REQUEST)
+        if since is None and request.data.get("since"):
+            return Response({"error": "Invalid 'since'."}, status=status.HTTP_400_BAD_REQUEST)
+        if any(updated_at is None for updated_at, _ in cursors.values()):
+            return Response({"error": "Invalid 'cursors'."}, status=status.HTTP_400_BAD_REQUEST)
+
+        synced_at = timezone.now()
+        rooms = list(
+            Room.objects.filter(members=request.user, is_active=True)
+            .inbox_for(request.user)
+            .only("id", "message_seq", "last_message_at", "created_at")
+        )
+        marks = {room.id: marks[room.id] for room in rooms if room.id in marks}
+        messages = sync.new_messages(marks)
+        changes = sync.changed_messages(marks, since, cursors)
+
+        context = {"request": request}
+        results = []
+        for room in rooms:
+            room_changes = changes.get(room.id, [])
+            more_changes = len(room_changes) > sync.SYNC_ROOM_LIMIT
+            room_changes = room_changes[:sync.SYNC_ROOM_LIMIT]
+            mark = marks.get(room.id)
+            more_messages = mark is not None and mark + sync.SYNC_ROOM_LIMIT < room.message_seq
+            results.append({
+                "room": room.id,
+                "message_seq": room.message_seq,
+                "unread_count": room.inbox_unread_count,
+                "messages": MessageSerializer(messages.get(room.id, []), many=True, context=context).data,
+                "changes": room_changes,
+                # Resume points for a room with has_more; changes past the cursor are
+                # returned on the next sync even though "since" moves on
+                "next_seq": min(mark + sync.SYNC_ROOM_LIMIT, room.message_seq) if mark is not None else None,
+                "changes_cursor": (
+                    {"updated_at": room_changes[-1]["updated_at"], "id": room_changes[-1]["id"]}
+                    if more_changes else None
+                ),
+                "has_more": more_messages or more_changes,
+            })
+        return Response({"synced_at": synced_at, "rooms": results}, status=status.HTTP_200_OK)
 
 
 # 4. API for listing all groups not just groups that are joined by the user
@@ -277,18 +531,17 @@ class UserGroupSearchAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        query = request.query_params.get('q', '')
-        groups = request.user.rooms.filter(is_active=True)
-        if query:
-            groups = groups.filter(
-                Q(name__icontains=query) | Q(description__icontains=query)
-            )
+        query = request.query_params.get('q', '').strip()
         if not query:
             return Response(
                 {"error": "Please Provide a search query."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        if not groups.exists():
+        groups = list(trigram_search(
+            request.user.rooms.filter(is_active=True), query, ["name", "description"],
+            limit=parse_limit(request.query_params.get('limit')),
+        ))
+        if not groups:
             return Response(
                 {"message": "No groups Found"},
                 status=status.HTTP_404_NOT_FOUND
@@ -308,19 +561,17 @@ class UserGroupMembersSearchAPIView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        query = request.query_params.get('q', '')
-        members = room.members.all()
-        if query:
-            members = members.filter(
-                Q(first_name__icontains=query)|
-                Q(last_name__icontains=query)
-            )
+        query = request.query_params.get('q', '').strip()
         if not query:
             return Response(
                 {"error": "Please Provide a search query."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        if not members.exists():
+        members = list(trigram_search(
+            room.members.all(), query, ["first_name", "last_name"],
+            limit=parse_limit(request.query_params.get('limit')),
+        ))
+        if not members:
             return Response(
                 {"message": "no user found"},
                 status=status.HTTP_404_NOT_FOUND
@@ -329,6 +580,60 @@ class UserGroupMembersSearchAPIView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class MessageSearchAPIView(ListAPIView):
+    """
+    Full-text search over the messages of every active room the user is a member of.
+    """
+    permission_classes = [IsAuthenticated]
+    serializer_class = MessageSearchResultSerializer
+    pagination_class = MessageSearchPagination
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get('q', '').strip():
+            return Response(
+                {"error": "Please Provide a search query."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return super().list(request, *args, **kwargs)
+
+    def get_messages(self):
+        return Message.objects.filter(room__in=self.request.user.rooms.filter(is_active=True))
+
+    def get_queryset(self):
+        messages = self.get_messages().select_related("sender", "parent_message__sender").prefetch_related("mentions")
+        return search_messages(messages, self.request.query_params['q'])
+
+
+class RoomMessageSearchAPIView(MessageSearchAPIView):
+    """
+    Full-text search over the messages of one room, for its members.
+    """
+
+    def get_messages(self):
+        room = get_object_or_404(Room, id=self.kwargs["room_id"], is_active=True)
+        if not room.members.filter(id=self.request.user.id).exists():
+            raise PermissionDenied("You are not a member of this room.")
+        return room.messages.all()
+
+
+def broadcast_attachment_message(msg, attachment_url):
+    """
+    Announce a message created through an upload endpoint to the room's sockets.
+    """
+    channel_layer = get_channel_layer()
+    payload = {
+        "message":      msg.content,
+        "attachment":   attachment_url,
+        "sender":       UserSerializer(msg.sender).data,
+        "message_type": msg.message_type,
+        "id":           msg.id,
+        "created_at":   msg.created_at.isoformat(),
+        "room":         msg.room_id,
+        "parent_message": get_parent_message_summary(msg.parent_message),
+    }
+    async_to_sync(channel_layer.group_send)(f"chat_{msg.room_id}", events.chat_message(payload))
+
+
 class MessageUploadView(CreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class   = MessageUploadSerializer
@@ -353,20 +658,105 @@ class MessageUploadView(CreateAPIView):
         )
 
         # broadcast over Channels
-        channel_layer = get_channel_layer()
-        payload = {
-            "type":         "chat_message",
-            "message":      msg.content,
-            "attachment":   msg.attachment.url,
-            "sender":       UserSerializer(msg.sender).data,
-            "message_type": msg.message_type,
-            "id":           msg.id,
-            "created_at":   msg.created_at.isoformat(),
-            "room":         room_id,
-            "parent_message_id": getattr(msg.parent_message, "id", None),
-        }
-        async_to_sync(channel_layer.group_send)(f"chat_{room_id}", payload)
+        broadcast_attachment_message(msg, msg.attachment.url)
 
     def get_queryset(self):
         # not used, but needed for routing
-        return Message.objects.none()
\ No newline at end of file
+        return Message.objects.none()
+
+
+def get_member_room(room_id, user):
+    room = get_object_or_404(Room, id=room_id, is_active=True)
+    if not room.members.filter(id=user.id).exists():
+        raise PermissionDenied("Not a member of this room.")
+    return room
+
+
+class MessageUploadSignAPIView(APIView):
+    """
+    First phase of a direct upload: return a signed target the client uploads the
+    file to, and the token to pass to MessageUploadFinalizeAPIView afterwards.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        room = get_member_room(room_id, request.user)
+        content_type = request.data.get("content_type", "application/octet-stream")
+        if not isinstance(content_type, str) or not content_type:
+            return Response({"error": "'content_type' must be a MIME type string."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        key = uploads.new_upload_key(room.id)
+        token = uploads.make_upload_token(room.id, request.user.id, key, content_type)
+        target = uploads.get_backend().signed_target(key, token, content_type)
+        if target["url"].startswith("/"):
+            target["url"] = request.build_absolute_uri(target["url"])
+        return Response({"upload_token": token, "upload": target}, status=status.HTTP_200_OK)
+
+
+class MessageUploadFinalizeAPIView(APIView):
+    """
+    Last phase of a direct upload: create the attachment message and broadcast it.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        room = get_member_room(room_id, request.user)
+        serializer = MessageUploadFinalizeSerializer(data=request.data, context={"room": room})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        try:
+            upload = uploads.read_upload_token(data["upload_token"], room_id=room.id, user_id=request.user.id)
+            attachment, attachment_url, message_type = uploads.get_backend().finalize(
+                upload["key"], upload["content_type"], request.data
+            )
+            if not uploads.claim_upload(upload["key"]):
+                raise uploads.UploadError("This upload has already been finalized.")
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            msg = create_room_message(
+                room,
+                request.user,
+                check_membership=False,
+                message_type=message_type,
+                content=data.get("content"),
+                attachment=attachment,
+                parent_message=data.get("parent_message"),
+            )
+        except Exception:
+            uploads.release_upload(upload["key"])
+            raise
+        broadcast_attachment_message(msg, attachment_url)
+        return Response(
+            {"id": msg.id, "attachment": attachment_url, "created_at": msg.created_at.isoformat()},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class LocalUploadTargetView(APIView):
+    """
+    Upload target of the local storage backend, standing in for Cloudinary. The
+    signed token in the URL is the only credential, as with a real signed upload.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request, token):
+        if settings.CHAT_UPLOAD_BACKEND != "local":
+            raise NotFound()
+        try:
+            upload = uploads.read_upload_token(token)
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        file = request.FILES.get("file")
+        if file is None:
+            return Response({"error": "'file' is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            uploads.LocalUploadBackend().store(upload["key"], file)
+        except uploads.UploadError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"key": upload["key"]}, status=status.HTTP_201_CREATED)
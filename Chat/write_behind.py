@@ -0,0 +1,188 @@
+"""
+Write-behind persistence for chat messages (settings.CHAT_WRITE_BEHIND).
+
+Instead of inserting each message before it is broadcast, ChatConsumer:
+
+  1. takes a message id from a block reserved from the Chat_message id sequence,
+  2. appends the message to the CHAT_MESSAGE_STREAM Redis Stream (XADD),
+  3. broadcasts it right away with that id.
+
+`manage.py flush_chat_messages` reads the stream through a consumer group and
+bulk-inserts the messages in batches, maintaining the room activity counters and
+mentions as the synchronous path does. Entries are only acknowledged after the batch
+has committed. A flusher that crashes leaves them pending, and they are replayed on
+restart or claimed by another flusher. Inserts are idempotent because every entry
+carries its final id.
+
+A message's created_at is the time Redis appended it, read from its stream id, so the
+stream order, created_at and (with one flusher) seq all agree, whichever worker's
+clock the sender was on. Entries are persisted in stream order; the only exceptions
+are entries claimed from a crashed flusher and concurrent flushers committing batches
+of the same room out of order, where seq may disagree with created_at by up to a batch.
+
+A batch that fails because of one of its entries (e.g. its sender was deleted before
+the flush) is retried one entry at a time; entries that still fail are moved to
+CHAT_MESSAGE_DEAD_LETTER_STREAM with the error and acknowledged, so they cannot block
+the stream. ChatConsumer validates the fields before enqueueing to keep this rare.
+
+Until its entry is flushed, a message only exists in the stream: editing, deleting,
+reacting to, pinning or replying to it and read receipts up to it fail as for an
+unknown id ("not found"). With flushers running, that window is about --block-ms, and
+clients should retry such actions after a short delay.
+
+Durability of unflushed messages is that of the Redis instance (enable AOF).
+"""
+import json
+import threading
+from collections import deque
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import DataError, IntegrityError, connection, transaction
+from core.redis_client import get_async_redis
+from .models import Room, Message, UserRoomStatus
+
+CONSUMER_GROUP = "chat-flushers"
+ID_BLOCK_SIZE = 100
+# Raised because of an entry's content rather than an unavailable database or a schema
+# problem; retrying the entry cannot succeed, so it is dead-lettered instead
+UNPERSISTABLE_ERRORS = (DataError, IntegrityError, KeyError, TypeError, ValueError)
+
+_reserved_ids = deque()
+_reserve_lock = threading.Lock()
+
+
+def reserve_message_id():
+    """
+    Return a fresh Message id. Ids are fetched from the table's sequence ID_BLOCK_SIZE
+    at a time, so only one in ID_BLOCK_SIZE messages costs a database round-trip.
+    """
+    with _reserve_lock:
+        if not _reserved_ids:
+            table = Message._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                    [f'"{table}"', ID_BLOCK_SIZE],
+                )
+                _reserved_ids.extend(row[0] for row in cursor.fetchall())
+        return _reserved_ids.popleft()
+
+
+async def enqueue_message(message_id, room_id, sender_id, message_type, content,
+                          attachment=None, parent_message_id=None, mentions=None):
+    """
+    Append a message to the write-behind stream. Returns its created_at timestamp.
+    """
+    entry = {
+        "id": message_id,
+        "room_id": room_id,
+        "sender_id": sender_id,
+        "message_type": message_type,
+        "content": content,
+        "attachment": attachment,
+        "parent_message_id": parent_message_id,
+        "mentions": mentions or [],
+    }
+    stream_id = await get_async_redis().xadd(settings.CHAT_MESSAGE_STREAM, {"message": json.dumps(entry)})
+    return stream_time(stream_id)
+
+
+def stream_time(stream_id):
+    """
+    The time Redis appended the entry `stream_id` ("<unix ms>-<n>").
+    """
+    milliseconds = int(stream_id.split("-")[0])
+    return datetime.fromtimestamp(milliseconds / 1000, tz=dt_timezone.utc)
+
+
+def decode_entries(entries):
+    """
+    Turn XREADGROUP/XAUTOCLAIM entries into (stream id, message dict) pairs.
+    """
+    decoded = []
+    for stream_id, fields in entries:
+        if not fields:
+            # Deleted from the stream while pending; nothing left to persist
+            decoded.append((stream_id, None))
+            continue
+        entry = json.loads(fields["message"])
+        entry["created_at"] = stream_time(stream_id)
+        decoded.append((stream_id, entry))
+    return decoded
+
+
+def persist_batch(entries):
+    """
+    Insert a batch of stream entries. Safe to call again with entries that were
+    already persisted (replay after a crash): those are skipped.
+
+    :return: (number of inserted messages, mention notifications to deliver)
+    """
+    from .utils import record_mentions
+
+    by_room = {}
+    for entry in entries:
+        if entry is not None:
+            by_room.setdefault(entry["room_id"], []).append(entry)
+
+    inserted = []
+    room_names = {}
+    with transaction.atomic():
+        # Lock rooms in a stable order so concurrent flushers cannot deadlock
+        for room_id in sorted(by_room):
+            room = Room.objects.select_for_update().filter(id=room_id).first()
+            if room is None:
+                continue  # Room deleted since the message was sent
+            room_names[room_id] = room.name
+
+            # Stable, so entries of the same millisecond keep their stream order
+            room_entries = sorted(by_room[room_id], key=lambda e: e["created_at"])
+            existing = set(
+                Message.objects.filter(id__in=[e["id"] for e in room_entries]).values_list("id", flat=True)
+            )
+            messages = []
+            seq = room.message_seq
+            for entry in room_entries:
+                if entry["id"] in existing:
+                    continue
+                seq += 1
+                message = Message(
+                    id=entry["id"],
+                    room_id=room_id,
+                    sender_id=entry["sender_id"],
+                    message_type=entry["message_type"],
+                    content=entry["content"],
+                    attachment=entry["attachment"],
+                    parent_message_id=entry["parent_message_id"],
+                    seq=seq,
+                    created_at=entry["created_at"],
+                )
+                messages.append((message, entry))
+            if not messages:
+                continue
+
+            Message.objects.bulk_create([message for message, _ in messages])
+
+            last = messages[-1][0]
+            Room.objects.filter(pk=room_id).update(
+                message_seq=seq, last_message=last, last_message_at=last.created_at
+            )
+            latest_by_sender = {message.sender_id: message for message, _ in messages}
+            UserRoomStatus.objects.bulk_create(
+                [
+                    UserRoomStatus(user_id=sender_id, room_id=room_id,
+                                   last_read=message.created_at, last_read_seq=message.seq)
+                    for sender_id, message in latest_by_sender.items()
+                ],
+                update_conflicts=True,
+                unique_fields=["user", "room"],
+                update_fields=["last_read", "last_read_seq"],
+            )
+            inserted.extend((message, entry) for message, entry in messages)
+
+        notifications = []
+        for message, entry in inserted:
+            if entry["mentions"]:
+                notifications.extend(record_mentions(message, entry["mentions"], room_names[message.room_id]))
+
+    return len(inserted), notifications
@@ -1,9 +1,9 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
+from core.websocket import WireProtocolMixin
 import logging
 logger = logging.getLogger(__name__)
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(WireProtocolMixin, AsyncWebsocketConsumer):
     async def connect(self):
         # Ensure that only authenticated users can connect
         self.user = self.scope["user"]
@@ -17,7 +17,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 self.channel_name
             )
-            await self.accept()
+            await self.accept_wire()
 
     async def disconnect(self, close_code):
         # print(f"Disconnecting WebSocket for group: {self.group_name} with code: {close_code}")
@@ -26,7 +26,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         # Currently, we're not processing client-sent messages.
         pass
 
@@ -37,6 +37,6 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         """
         notification = event["notification"]
         # Send the notification data to the client
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             "notification": notification
-        }))
+        })
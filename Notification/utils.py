@@ -48,4 +48,48 @@ def send_push_notification_individual(user, title, body, click_action=None, extr
         )
         response = messaging.send(message)
         responses.append(response)
-    return responses
\ No newline at end of file
+    return responses
+
+# FCM rejects multicast requests carrying more than 500 registration tokens.
+FCM_MULTICAST_BATCH_SIZE = 500
+
+def send_push_notification_multicast(user_ids, title, body, click_action=None, extra_data=None):
+    """
+    Send the same push notification to every registered Android device of the given users.
+
+    All device tokens are collected in a single query and delivered as FCM multicast
+    requests of at most FCM_MULTICAST_BATCH_SIZE tokens each.
+
+    :param user_ids: Iterable of user IDs to notify.
+    :param title: Notification title.
+    :param body: Notification body.
+    :param click_action: Optional action string or deep-link for the notification.
+    :param extra_data: Optional dictionary of additional data.
+    :return: List of BatchResponse objects, one per multicast request.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+
+    tokens = list(
+        DeviceToken.objects.filter(
+            user_id__in=user_ids,
+            device_type=DeviceToken.ANDROID,
+        ).values_list('device_token', flat=True)
+    )
+    if not tokens:
+        return []
+
+    data = {**(extra_data or {}), "click_action": click_action} if click_action else (extra_data or {})
+    responses = []
+    for start in range(0, len(tokens), FCM_MULTICAST_BATCH_SIZE):
+        message = messaging.MulticastMessage(
+            notification=messaging.Notification(
+                title=title,
+                body=body,
+            ),
+            data=data,
+            tokens=tokens[start:start + FCM_MULTICAST_BATCH_SIZE],
+        )
+        responses.append(messaging.send_each_for_multicast(message))
+    return responses
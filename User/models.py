@@ -5,6 +5,7 @@ from Domain.models import Domain
 from django.core.exceptions import ValidationError
 from django.utils.timezone import now
 from django.conf import settings
+from core.search import trigram_index
 
 
 
@@ -96,6 +97,13 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'role', 'year']
 
+    class Meta:
+        indexes = [
+            # People search (core.search.trigram_search)
+            trigram_index("first_name", "user_first_name_trgm_idx"),
+            trigram_index("last_name", "user_last_name_trgm_idx"),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.role})"
     
@@ -19,7 +19,7 @@ import random
 from google.auth.transport import requests as google_requests
 from google.oauth2 import id_token
 from decouple import config
-from django.db.models import Q
+from core.search import parse_limit, trigram_search
 from .serializers import (StudentRegistrationSerializer,
                           EmailVerificationSerializer, LoginSerializer)
 from django.utils import timezone
@@ -206,8 +206,9 @@ class MembersSearchAPIView(APIView):
                 {"error":"please provide a search query"},status=status.HTTP_400_BAD_REQUEST
             )
 
-        users=User.objects.filter(
-            Q(first_name__icontains=query)|Q(last_name__icontains=query)
+        users = trigram_search(
+            User.objects.all(), query, ["first_name", "last_name"],
+            limit=parse_limit(request.query_params.get('limit')),
         )
 
         serializer = UserSerializer(users, many=True)
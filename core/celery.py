@@ -1,11 +1,11 @@
-# import os
-# from celery import Celery
+import os
+from celery import Celery
 
-# # Set the default Django settings module for the 'celery' program.
-# os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Set the default Django settings module for the 'celery' program.
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-# app = Celery('core')
+app = Celery('core')
 
-# # Load task modules from all registered Django app configs.
-# app.config_from_object('django.conf:settings', namespace='CELERY')
-# app.autodiscover_tasks()
+# Load task modules from all registered Django app configs.
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
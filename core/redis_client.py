@@ -0,0 +1,31 @@
+import asyncio
+import weakref
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+
+_sync_client = None
+# redis.asyncio connections are bound to the event loop that created them.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """
+    Return the process-wide synchronous Redis client for settings.REDIS_URL.
+    """
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+    return _sync_client
+
+
+def get_async_redis():
+    """
+    Return the asyncio Redis client for settings.REDIS_URL bound to the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+        _async_clients[loop] = client
+    return client
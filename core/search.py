@@ -0,0 +1,57 @@
+"""
+Type-ahead search over short text columns (names, titles) with pg_trgm.
+
+Every searchable column gets a GIN index on UPPER(column) with gin_trgm_ops (see
+trigram_index). That one index serves both matchers used here: the case-insensitive
+prefix match (UPPER(column) LIKE 'Q%') and the fuzzy word-similarity operator (%>),
+so neither falls back to a sequential scan.
+"""
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.functions import Greatest, Upper
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+
+def trigram_index(field, name):
+    return GinIndex(OpClass(Upper(field), name="gin_trgm_ops"), name=name)
+
+
+def parse_limit(value):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def trigram_search(queryset, query, fields, limit=DEFAULT_LIMIT):
+    """
+    Return up to `limit` rows of `queryset` where any of `fields` starts with `query`
+    or contains a word similar to it, best match first.
+
+    Prefix matches rank above fuzzy ones, so results stay stable while the user types;
+    among equals the highest trigram word similarity wins.
+    """
+    query = query.strip()
+    match = Q()
+    prefix_matches = []
+    similarities = []
+    for field in fields:
+        alias = f"{field}_upper"
+        queryset = queryset.alias(**{alias: Upper(field)})
+        prefix = Q(**{f"{alias}__startswith": query.upper()})
+        match |= prefix | Q(**{f"{alias}__trigram_word_similar": query})
+        prefix_matches.append(When(prefix, then=Value(1.0)))
+        similarities.append(TrigramWordSimilarity(query, alias))
+
+    return (
+        queryset.filter(match)
+        .annotate(
+            search_rank=Case(*prefix_matches, default=Value(0.0), output_field=FloatField())
+            + (Greatest(*similarities) if len(similarities) > 1 else similarities[0])
+        )
+        .order_by("-search_rank", *fields, "pk")[:limit]
+    )
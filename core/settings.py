@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'channels',
@@ -69,15 +70,58 @@ ASGI_APPLICATION = "core.asgi.application"
 
 
 
-CHANNEL_LAYERS = {
-    "default": {
+REDIS_URL = config("REDIS_URL")
+
+# Channel layer used for room fan-out, picked with CHANNEL_LAYER:
+#   "redis"   channels_redis.core.RedisChannelLayer (default). group_send pushes the event
+#             onto the list of every member channel: one Redis operation per member and
+#             event, and events for a channel holding CHANNEL_LAYER_CAPACITY of them are
+#             dropped silently.
+#   "pubsub"  channels_redis.pubsub.RedisPubSubChannelLayer. group_send is a single PUBLISH
+#             whatever the size of the room, and nothing is queued in Redis. An event
+#             published while a socket is reconnecting is not replayed; clients catch up
+#             through the chat sync endpoint.
+# `manage.py bench_channel_layers` compares both on the chat event mix.
+CHANNEL_LAYER = config("CHANNEL_LAYER", default="redis")
+CHANNEL_LAYER_CAPACITY = config("CHANNEL_LAYER_CAPACITY", default=100, cast=int)
+
+CHANNEL_LAYER_CONFIGS = {
+    "redis": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [config("REDIS_URL")],
+            "hosts": [REDIS_URL],
+            "capacity": CHANNEL_LAYER_CAPACITY,
+        },
+    },
+    "pubsub": {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+        "CONFIG": {
+            "hosts": [REDIS_URL],
         },
     },
 }
 
+CHANNEL_LAYERS = {
+    "default": CHANNEL_LAYER_CONFIGS[CHANNEL_LAYER],
+}
+
+# Chat presence: a connection counts as online for PRESENCE_TTL seconds after its
+# last heartbeat; consumers refresh it every PRESENCE_HEARTBEAT_INTERVAL seconds.
+PRESENCE_TTL = config("PRESENCE_TTL", default=90, cast=int)
+PRESENCE_HEARTBEAT_INTERVAL = config("PRESENCE_HEARTBEAT_INTERVAL", default=30, cast=int)
+
+# Chat write-behind: when enabled, new chat messages are appended to a Redis Stream and
+# broadcast immediately; `manage.py flush_chat_messages` persists them in batches.
+# Disabled (the default), every message is inserted before it is broadcast. Entries the
+# flusher cannot insert are moved to CHAT_MESSAGE_DEAD_LETTER_STREAM for inspection.
+CHAT_WRITE_BEHIND = config("CHAT_WRITE_BEHIND", default=False, cast=bool)
+CHAT_MESSAGE_STREAM = config("CHAT_MESSAGE_STREAM", default="chat:messages")
+CHAT_MESSAGE_DEAD_LETTER_STREAM = config("CHAT_MESSAGE_DEAD_LETTER_STREAM", default="chat:messages:dead")
+
+# Chat attachments are uploaded by clients straight to this backend (see Chat.uploads):
+# "cloudinary", or "local" to store them under MEDIA_ROOT when working offline.
+CHAT_UPLOAD_BACKEND = config("CHAT_UPLOAD_BACKEND", default="cloudinary")
+
 
 
 
@@ -173,18 +217,28 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 
-# # Celery Configuration
-# CELERY_BROKER_URL = 'redis://localhost:6379/0'
-# CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
-# CELERY_ACCEPT_CONTENT = ['json']
-# CELERY_TASK_SERIALIZER = 'json'
-# CELERY_RESULT_SERIALIZER = 'json'
+# Celery Configuration. Run the worker with the beat scheduler for the periodic jobs
+# below: `celery -A core worker --beat`.
+CELERY_BROKER_URL = config("CELERY_BROKER_URL", default=REDIS_URL)
+CELERY_RESULT_BACKEND = CELERY_BROKER_URL
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
 
 # from celery.schedules import crontab
 
-# CELERY_BEAT_SCHEDULE = {
-#     'auto-checkout-everyday': {
-#         'task': 'Attendance.tasks.auto_checkout',  # Ensure the path matches your Attendance app's tasks.py
-#         'schedule': crontab(minute=59, hour=23),     # Runs daily at 23:59
-#     },
-# }
+# Chat read positions are recorded in Redis and persisted by this job (see Chat.read_state)
+READ_STATE_FLUSH_INTERVAL = config("READ_STATE_FLUSH_INTERVAL", default=5.0, cast=float)
+
+CELERY_BEAT_SCHEDULE = {
+    # 'auto-checkout-everyday': {
+    #     'task': 'Attendance.tasks.auto_checkout',  # Ensure the path matches your Attendance app's tasks.py
+    #     'schedule': crontab(minute=59, hour=23),     # Runs daily at 23:59
+    # },
+    'flush-read-positions': {
+        'task': 'Chat.tasks.flush_read_positions',
+        'schedule': READ_STATE_FLUSH_INTERVAL,
+        # A run still queued when the next one is due is dropped instead of piling up
+        'options': {'expires': READ_STATE_FLUSH_INTERVAL},
+    },
+}
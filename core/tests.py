@@ -0,0 +1,47 @@
+import zlib
+from django.test import SimpleTestCase
+from .websocket import (
+    MAX_INFLATED_FRAME, MSGPACK_DEFLATE, Deflater, FrameTooLarge, Inflater, InflateError, WireProtocolMixin,
+    pack_frame,
+)
+
+
+class DeflateTests(SimpleTestCase):
+    def test_frames_round_trip_on_one_stream(self):
+        deflater, inflater = Deflater(), Inflater()
+        for payload in (b"first frame", b"second frame" * 10, b""):
+            self.assertEqual(inflater.decompress(deflater.compress(payload)), payload)
+
+    def test_inflated_size_is_capped(self):
+        deflater, inflater = Deflater(), Inflater()
+        bomb = deflater.compress(b"\0" * (MAX_INFLATED_FRAME * 20))
+        self.assertLess(len(bomb), MAX_INFLATED_FRAME // 10)
+        with self.assertRaises(FrameTooLarge):
+            inflater.decompress(bomb)
+
+    def test_frame_of_the_maximum_size_is_accepted(self):
+        payload = b"x" * MAX_INFLATED_FRAME
+        self.assertEqual(Inflater().decompress(Deflater().compress(payload)), payload)
+
+    def test_invalid_deflate_data(self):
+        with self.assertRaises(InflateError):
+            Inflater().decompress(b"\xff\xff\xff\xff")
+
+
+class DecodePayloadTests(SimpleTestCase):
+    def socket(self):
+        socket = WireProtocolMixin()
+        socket.wire = MSGPACK_DEFLATE
+        socket.inflater = Inflater()
+        return socket
+
+    def test_malformed_payload_is_a_value_error_but_not_an_inflate_error(self):
+        deflater = Deflater()
+        with self.assertRaises(ValueError) as raised:
+            self.socket().decode_payload(bytes_data=deflater.compress(pack_frame([1, 2])))
+        self.assertNotIsInstance(raised.exception, InflateError)
+
+    def test_corrupt_stream_is_an_inflate_error(self):
+        with self.assertRaises(InflateError) as raised:
+            self.socket().decode_payload(bytes_data=zlib.compress(b"not raw deflate"))
+        self.assertEqual(raised.exception.close_code, 1007)
@@ -11,8 +11,10 @@ from rest_framework import generics
 from Announcement.models import Announcement 
 from Task.models import Task
 from Announcement.models import Announcement
-from Chat.models import Room, UserRoomStatus
-from django.db.models import Max
+from Chat.models import Room, count_subquery
+from django.contrib.auth import get_user_model
+from django.db.models import F, FilteredRelation, Q
+from django.db.models.functions import Coalesce
 
 
 def warm_up(request):
@@ -69,6 +71,32 @@ class HomepageAnnouncementsAPIView(generics.ListAPIView):
         user = self.request.user
         return Announcement.objects.filter(receivers=user).order_by('-created_at')
     
+def homepage_counts(user):
+    """
+    Return the homepage counters of `user`, computed by one SQL statement made of three
+    scalar subqueries:
+
+      tasks_assigned           pending and current tasks of the user's task groups
+      chat_groups_with_unread  rooms whose message counter is ahead of the user's read
+                               position (joined from UserRoomStatus)
+      announcement_count       announcements the user received
+    """
+    tasks = Task.objects.filter(
+        pk__in=Task.objects.filter(groups__members=user).values("pk"),
+        status__in=['pending', 'current'],
+    )
+    unread_rooms = Room.objects.filter(members=user).annotate(
+        read_status=FilteredRelation("user_statuses", condition=Q(user_statuses__user=user)),
+    ).filter(message_seq__gt=Coalesce(F("read_status__last_read_seq"), 0))
+    announcements = Announcement.objects.filter(receivers=user)
+
+    return get_user_model().objects.filter(pk=user.pk).annotate(
+        tasks_assigned=count_subquery(tasks),
+        chat_groups_with_unread=count_subquery(unread_rooms),
+        announcement_count=count_subquery(announcements),
+    ).values("tasks_assigned", "chat_groups_with_unread", "announcement_count").get()
+
+
 class HomepageCountsAPIView(APIView):
     """
     Returns counts for the logged-in user:
@@ -85,43 +113,16 @@ class HomepageCountsAPIView(APIView):
 
         photo= user.photo
 
-        # 1. Count tasks assigned to the user (only pending and current tasks)
-        tasks_count = Task.objects.filter(
-            groups__members=user,
-            status__in=['pending', 'current']
-        ).distinct().count()
-
-        # 2. Count chat groups (rooms) with unread messages.
-        # We'll retrieve rooms where the user is a member and annotate them with the latest message timestamp.
-        rooms = Room.objects.filter(members=user).annotate(
-            latest_message=Max('messages__created_at')
-        )
-        unread_chat_count = 0
-        for room in rooms:
-            try:
-                # Get the user's last read time for this room.
-                user_status = room.user_statuses.get(user=user)
-                last_read = user_status.last_read
-            except UserRoomStatus.DoesNotExist:
-                # If no status record exists, consider the room as having unread messages.
-                last_read = None
-
-            # If the room has any messages and either the user hasn't read any message yet or
-            # the latest message is more recent than the last read timestamp, count it as unread.
-            if room.latest_message and (last_read is None or room.latest_message > last_read):
-                unread_chat_count += 1
-
-        # 3. Count announcements where the user is a receiver.
-        announcements_count = Announcement.objects.filter(receivers=user).count()
+        counts = homepage_counts(user)
 
         response_data = {
             "photo":photo.url if photo else None,
             "name": first_name,
             "year": year,
             "is_completed": request.user.is_completed,
-            "tasks_assigned": tasks_count,
-            "chat_groups_with_unread": unread_chat_count,
-            "announcement_count": announcements_count,
+            "tasks_assigned": counts["tasks_assigned"],
+            "chat_groups_with_unread": counts["chat_groups_with_unread"],
+            "announcement_count": counts["announcement_count"],
         }
 
         return Response(response_data, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -0,0 +1,135 @@
+"""
+Wire formats for the WebSocket consumers.
+
+Clients pick one through the WebSocket subprotocol handshake (Sec-WebSocket-Protocol):
+
+  (none) or "json"    JSON text frames, the default
+  "msgpack"           msgpack binary frames
+  "msgpack.deflate"   msgpack frames compressed with one raw DEFLATE stream per
+                      connection and direction, flushed after every frame with the
+                      trailing 00 00 ff ff removed (as in permessage-deflate, RFC 7692).
+                      Keys repeated across frames (sender, photo, created_at, ...)
+                      compress to back-references.
+
+The payloads are the same in every format. Compression is done here rather than by
+the ASGI server because daphne does not negotiate permessage-deflate.
+
+Each direction is one DEFLATE stream, so frames must be compressed in the order they
+are sent, and a client frame that fails to inflate leaves the inbound stream corrupt:
+decode_payload raises InflateError and the socket has to be closed.
+"""
+import json
+import zlib
+import msgpack
+
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_DEFLATE = "msgpack.deflate"
+
+# Preferred first when a client offers several
+SUBPROTOCOLS = (MSGPACK_DEFLATE, MSGPACK, JSON)
+
+_DEFLATE_TAIL = b"\x00\x00\xff\xff"
+# Largest client frame accepted once inflated, so a small compressed frame cannot
+# expand into gigabytes (zip bomb)
+MAX_INFLATED_FRAME = 1024 * 1024
+
+CLOSE_CODE_INVALID_DATA = 1007
+CLOSE_CODE_TOO_BIG = 1009
+
+
+class InflateError(ValueError):
+    """
+    A client frame could not be inflated. The connection's inbound DEFLATE stream is
+    lost, so the socket must be closed with `close_code`.
+    """
+    close_code = CLOSE_CODE_INVALID_DATA
+
+
+class FrameTooLarge(InflateError):
+    close_code = CLOSE_CODE_TOO_BIG
+
+
+def pack_frame(payload):
+    return msgpack.packb(payload, use_bin_type=True)
+
+
+class Deflater:
+    def __init__(self):
+        self.compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+    def compress(self, data):
+        data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data[:-len(_DEFLATE_TAIL)]
+
+
+class Inflater:
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        """
+        Raises FrameTooLarge if the frame inflates to more than MAX_INFLATED_FRAME bytes
+        and InflateError if it is not valid DEFLATE data.
+        """
+        try:
+            # One byte over the limit tells a frame of exactly MAX_INFLATED_FRAME from a larger one
+            inflated = self.decompressor.decompress(data + _DEFLATE_TAIL, MAX_INFLATED_FRAME + 1)
+        except zlib.error as e:
+            raise InflateError(str(e))
+        if len(inflated) > MAX_INFLATED_FRAME:
+            raise FrameTooLarge("Frame exceeds the inflated size limit")
+        return inflated
+
+
+class WireProtocolMixin:
+    """
+    Mixin for AsyncWebsocketConsumer adding the negotiated wire format. Consumers call
+    accept_wire() instead of accept(), send dicts with send_payload(), forward
+    pre-encoded frames with send_frame() and decode input with decode_payload().
+    """
+    wire = JSON
+
+    async def accept_wire(self):
+        offered = self.scope.get("subprotocols") or ()
+        self.wire = next((protocol for protocol in SUBPROTOCOLS if protocol in offered), JSON)
+        if self.wire == MSGPACK_DEFLATE:
+            self.deflater, self.inflater = Deflater(), Inflater()
+        await self.accept(subprotocol=self.wire if self.wire in offered else None)
+
+    async def send_payload(self, payload):
+        if self.wire == JSON:
+            await self.send(text_data=json.dumps(payload))
+        else:
+            await self.send_packed(pack_frame(payload))
+
+    async def send_frame(self, text, packed):
+        """
+        Send a frame encoded ahead of time in both formats (see Chat.events).
+        """
+        if self.wire == JSON:
+            await self.send(text_data=text)
+        else:
+            await self.send_packed(packed)
+
+    async def send_packed(self, packed):
+        if self.wire == MSGPACK_DEFLATE:
+            packed = self.deflater.compress(packed)
+        await self.send(bytes_data=packed)
+
+    def decode_payload(self, text_data=None, bytes_data=None):
+        """
+        Decode a client frame. Raises ValueError if it is malformed, InflateError (a
+        ValueError) if the socket can no longer be read and must be closed.
+        """
+        if text_data is not None:
+            return json.loads(text_data)
+        if self.wire == MSGPACK_DEFLATE:
+            bytes_data = self.inflater.decompress(bytes_data)
+        try:
+            payload = msgpack.unpackb(bytes_data, raw=False)
+        except Exception as e:
+            raise ValueError(str(e))
+        if not isinstance(payload, dict):
+            raise ValueError("Expected a map.")
+        return payload